@@ -10,12 +10,7 @@ class Thumbnail():
         self.pixelArray = pixelArray    # numpy array of pixels
     
     def showImage(self):
-        image = np.zeros((8, 8, 3))
-        
-        for i in range(64):
-            image[i // 8][i % 8][0] = self.pixelArray[i*3]
-            image[i // 8][i % 8][1] = self.pixelArray[i*3+1]
-            image[i // 8][i % 8][2] = self.pixelArray[i*3+2]
+        image = toImages(self.pixelArray[np.newaxis, :]).astype(float)[0]
         
         plt.imshow(image)
         plt.show()
@@ -25,10 +20,73 @@ class Thumbnail():
         return self.pixelArray
         
     def grayscale(self):
-        pixels = np.zeros(64)
-        for i in range(0, 192, 3):
-            new = int(i/3)
-            pixels[new] = np.sum(self.pixelArray[i:i+3])/3
-        self.pixelArray = pixels
+        self.pixelArray = grayscaleRows(self.pixelArray[np.newaxis, :])[0]
+
+
+def normalizeRows(pixels, out = None):
+    '''
+    Returns (N x 192) float array: each row of pixels divided by its L2 norm,
+    as Thumbnail.normalize() does for one image
     
-            
+    Inputs:
+        pixels - (N x 192) array of pixels
+        out - optional preallocated (N x 192) float array for the result; may
+              be pixels itself when pixels is a float array
+    '''
+    if out is None:
+        out = np.empty(pixels.shape)
+    # pixel values are small integers, so casting them to any float type is exact,
+    # even from int64 (the pixels of a list of Thumbnail) to float32
+    norms = np.einsum('ij,ij->i', pixels, pixels, dtype = out.dtype, casting = 'unsafe')[:, np.newaxis]
+    np.sqrt(norms, out = norms)
+    np.divide(pixels, norms, out = out, dtype = out.dtype, casting = 'unsafe')
+    return out
+
+def grayscaleRows(pixels, out = None):
+    '''
+    Returns (N x 64) float array: the mean of each pixel's 3 color values,
+    as Thumbnail.grayscale() computes for one image
+    
+    Inputs:
+        pixels - (N x 192) array of pixels
+        out - optional preallocated (N x 64) float array for the result
+    '''
+    if out is None:
+        out = np.empty((len(pixels), pixels.shape[1] // 3))
+    np.sum(pixels.reshape(len(pixels), -1, 3), axis = 2, out = out, dtype = out.dtype)
+    out /= 3
+    return out
+
+def toImages(pixels):
+    '''
+    Returns (N x 8 x 8 x 3) view of a (N x 192) pixel array, the layout
+    expected by plt.imshow()
+    '''
+    return pixels.reshape(len(pixels), 8, 8, 3)
+
+class ThumbnailSet():
+    '''
+    Columnar collection of thumbnails: an (N x 192) uint8 pixel matrix plus
+    arrays of photo ids and orientations. It can be used like a list of
+    Thumbnail, but each Thumbnail is only created when it is asked for.
+    '''
+    def __init__(self, photoIds, orientations, pixels, normalizedPixels = None):
+        self.photoIds = photoIds            # numpy array of strings
+        self.orientations = orientations    # numpy array of orientation values (0, 90, 180, 270)
+        self.pixels = pixels                # numpy (N x 192) uint8 array of pixels
+        self.normalizedPixels = normalizedPixels # optional normalizeRows(pixels), e.g. memory-mapped from a cache
+    
+    def __len__(self):
+        return len(self.pixels)
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            normalized = self.normalizedPixels[i] if self.normalizedPixels is not None else None
+            return ThumbnailSet(self.photoIds[i], self.orientations[i], self.pixels[i], normalized)
+        return Thumbnail(str(self.photoIds[i]), Orientation(int(self.orientations[i])), 
+                         self.pixels[i].astype(int))
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
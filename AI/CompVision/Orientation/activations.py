@@ -17,7 +17,7 @@ class Activation():
         '''
         self.atype = atype
         
-    def activate(self, X, W, b):
+    def activate(self, X, W, b, out = None):
         '''
         Represents the activation of a neural layer
         
@@ -25,55 +25,82 @@ class Activation():
             X - array of data
             W - array of weights
             b - array of bias neurons
+            out - optional pair of preallocated arrays (Z, A) that receive the
+                  weighted input and the activation
         
         Output:
             output of nodes after activation function is applied
         '''
-        return self.atype.activate(X.dot(W) + b)
-    
-    def dAHidden(self, A_in, A_out, E_next, W):
+        if out is None:
+            return self.atype.activate(X.dot(W) + b)
+        Z, A = out
+        np.dot(X, W, out = Z)
+        Z += b
+        return self.atype.activate(Z, out = A)
+    
+    def dAHidden(self, A_in, A_out, E_next, W, out = None):
         '''
         E - array of Error being propagated back from next layer
         W - array of weights leading from this layer to the layer that is source of E
         Z - array of outputs from this layer
+        out - optional preallocated arrays (deltas, E, D); D receives the derivative
         returns 2 arrays: inputs.T .* errors, errors
         '''
-        E = E_next.dot(W.T) * self.atype.derivative(A_out)
-        deltas = A_in.T.dot(E)
+        if out is None:
+            E = E_next.dot(W.T) * self.atype.derivative(A_out)
+            deltas = A_in.T.dot(E)
+            return deltas, E
+        deltas, E, D = out
+        np.dot(E_next, W.T, out = E)
+        E *= self.atype.derivative(A_out, out = D)
+        np.dot(A_in.T, E, out = deltas)
         return deltas, E
     
-    def dO(self, Y, T, H):
+    def dO(self, Y, T, H, out = None):
         '''
         gradient from output back to nearest hidden layer
         T - ground Truth
         Y - activations (predictions) of output layer
         H - activations from nearest/last hidden layer
+        out - optional preallocated arrays (deltas, E)
         returns 2 arrays: inputs.T .* errors, errors
         '''
-        E = Y - T
-        return H.T.dot(E), E # Y - T = derivative of softmax 
+        if out is None:
+            E = Y - T
+            return H.T.dot(E), E # Y - T = derivative of softmax 
+        deltas, E = out
+        np.subtract(Y, T, out = E)
+        np.dot(H.T, E, out = deltas)
+        return deltas, E
     
-    def initializeWeights(self, N, Nplus1, numLayers):
+    def initializeWeights(self, N, Nplus1, numLayers, dtype = np.float64):
         '''
         N - number of nodes in this layer
         Nplus1 - number of nodes in next layer
+        dtype - float type of the returned weights
         '''
-        return self.atype.initializeWeights(N, Nplus1, numLayers)
+        return self.atype.initializeWeights(N, Nplus1, numLayers).astype(dtype, copy = False)
     
     def learningRate(self, epoch):
         return self.atype.learningRate(epoch)
     
     def biasFactor(self):
         return self.atype.biasFactor()
+    
+    def name(self):
+        return type(self.atype).__name__.lower()
         
 
 class Tanh():
     
-    def activate(self, Z):
-        return np.tanh(Z), Z
+    def activate(self, Z, out = None):
+        return np.tanh(Z, out = out), Z
     
-    def derivative(self, Z):
-        return 1 - Z*Z # https://github.com/lazyprogrammer/machine_learning_examples/blob/master/ann_class/backprop.py
+    def derivative(self, Z, out = None):
+        if out is None:
+            return 1 - Z*Z # https://github.com/lazyprogrammer/machine_learning_examples/blob/master/ann_class/backprop.py
+        np.multiply(Z, Z, out = out)
+        return np.subtract(1, out, out = out)
     
     def initializeWeights(self, N, Nplus1, numLayers):
         # Glorot algorighm; see https://intoli.com/blog/neural-network-initialization/
@@ -88,11 +115,14 @@ class Tanh():
     
 class Relu():
     
-    def activate(self, Z):
-        return Z * (Z > 0), Z
+    def activate(self, Z, out = None):
+        if out is None:
+            return Z * (Z > 0), Z
+        np.greater(Z, 0, out = out)
+        return np.multiply(Z, out, out = out), Z
     
-    def derivative(self, Z):
-        return Z > 0 # https://github.com/lazyprogrammer/machine_learning_examples/blob/master/ann_class/backprop.py
+    def derivative(self, Z, out = None):
+        return np.greater(Z, 0, out = out) # https://github.com/lazyprogrammer/machine_learning_examples/blob/master/ann_class/backprop.py
     
     def initializeWeights(self, N, Nplus1, numLayers):
         # uniform distribution, slight skew toward positive suggested by https://intoli.com/blog/neural-network-initialization/
@@ -109,14 +139,20 @@ class Relu():
 
 class Sigmoid():
     
-    def activate(self, Z):
-        return expit(Z), Z
+    def activate(self, Z, out = None):
+        return expit(Z, out = out), Z
         
-    def derivative(self, Z):
+    def derivative(self, Z, out = None):
         try:
-            return Z * (1 - Z) # https://github.com/lazyprogrammer/machine_learning_examples/blob/master/ann_class/backprop.py
+            if out is None:
+                return Z * (1 - Z) # https://github.com/lazyprogrammer/machine_learning_examples/blob/master/ann_class/backprop.py
+            np.subtract(1, Z, out = out)
+            return np.multiply(Z, out, out = out)
         except:
-            return 100 * np.ones(Z.shape)
+            if out is None:
+                return 100 * np.ones(Z.shape)
+            out.fill(100)
+            return out
  
     def initializeWeights(self, N, Nplus1, numLayers):
         # Glorot algorighm; see https://intoli.com/blog/neural-network-initialization/
@@ -126,3 +162,5 @@ class Sigmoid():
     def learningRate(self, epoch):
         return 1e-2 * (100.0 + epoch)
     
+
+activationTypes = {"tanh": Tanh, "relu": Relu, "sigmoid": Sigmoid}
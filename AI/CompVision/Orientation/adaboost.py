@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+AdaBoost classifier for orient.py's "adaboost" model
+
+Each weak learner is a decision stump over one pixel-pair comparison: "is
+pixel i brighter than pixel j?". One binary booster per orientation learns
+to tell that orientation from the other 3, and the orientation whose booster
+is most confident wins.
+
+The comparisons of every training image with every candidate pixel pair are
+computed once, before boosting, and packed 8 per byte into an (N x pairs/8)
+uint8 matrix. Each boosting round then finds the best stump of all 4
+boosters at once: the weighted errors of all candidate stumps are one matrix
+product of the unpacked comparisons with the signed sample weights.
+
+@author: Alex DeCourcy, Anthony Duer, Chris Falter
+"""
+import itertools
+import numpy as np
+from Prediction import Prediction
+from fileIO import writeCacheFile, npzPath, readNpz
+from nn import pixelMatrix, orientationValues, dPosition, dPrediction
+
+def candidatePairs(numPixels, numPairs, seed):
+    '''
+    returns (numPairs x 2) array of distinct pixel index pairs (i, j), i < j,
+    drawn at random; all pairs if numPairs is None or exceeds their number
+    '''
+    pairs = np.array(list(itertools.combinations(range(numPixels), 2)), dtype = np.uint8)
+    if numPairs is None or numPairs >= len(pairs):
+        return pairs
+    chosen = np.random.RandomState(seed).choice(len(pairs), numPairs, replace = False)
+    return pairs[np.sort(chosen)]
+
+def packedComparisons(pixels, pairs, blockSize):
+    '''
+    returns (N x ceil(len(pairs)/8)) uint8 array: bit f of row n is set when
+    pixel pairs[f, 0] of image n is brighter than pixel pairs[f, 1]
+    '''
+    packed = np.empty((len(pixels), (len(pairs) + 7) // 8), dtype = np.uint8)
+    for start in range(0, len(pixels), blockSize):
+        X = pixels[start:start + blockSize]
+        packed[start:start + len(X)] = np.packbits(X[:, pairs[:, 0]] > X[:, pairs[:, 1]], axis = 1)
+    return packed
+
+class Adaboost():
+
+    def __init__(self, rounds = 200, numPairs = 2000, blockSize = 2048, seed = 0):
+        '''
+        Input:
+            rounds - number of stumps per orientation
+            numPairs - number of candidate pixel pairs drawn from all 18,336
+                       pairs of the 192 pixel values; None uses all of them
+            blockSize - number of images whose comparisons are unpacked at once
+            seed - random seed for drawing the candidate pairs
+        '''
+        self.rounds = rounds
+        self.numPairs = numPairs
+        self.blockSize = blockSize
+        self.seed = seed
+
+    def train(self, trainData, paramsFile):
+        '''
+        boosts one stump per round and orientation; writes the chosen pixel
+        pairs, stump polarities and stump weights to paramsFile (.npz is
+        appended if missing)
+        '''
+        pixels = pixelMatrix(trainData)
+        positions = np.array([dPosition[y] for y in orientationValues(trainData)])
+        pairs = candidatePairs(pixels.shape[1], self.numPairs, self.seed)
+        packed = packedComparisons(pixels, pairs, self.blockSize)
+
+        numObservations, numClasses = len(pixels), len(dPrediction)
+        Y = positions[:, np.newaxis] == np.arange(numClasses)    # (N x 4) one-vs-all targets
+        Ysign = np.where(Y, 1.0, -1.0)
+        weights = np.full((numObservations, numClasses), 1.0 / numObservations)
+        chosen = np.empty((numClasses, self.rounds), dtype = np.intp)
+        polarities = np.empty((numClasses, self.rounds), dtype = np.int8)
+        alphas = np.empty((numClasses, self.rounds))
+        columns = np.arange(numClasses)
+        for t in range(self.rounds):
+            # error of stump f for class c, predicting c when its comparison holds:
+            # sum of w over positives plus sum of F[:, f] * w * (1 - 2y) over all images
+            errors = np.sum(weights * Y, axis = 0) + self.signedSums(packed, -weights * Ysign, len(pairs))
+            best = np.argmax(np.abs(errors - 0.5), axis = 0)
+            error = errors[best, columns]
+            polarity = np.where(error < 0.5, 1, -1)
+            error = np.clip(np.minimum(error, 1 - error), 1e-10, 1 - 1e-10)
+            alpha = 0.5 * np.log((1 - error) / error)
+
+            # stump outputs (+1/-1) on the training images, from the packed bits
+            bits = (packed[:, best // 8] >> (7 - best % 8)) & 1
+            H = polarity * (2.0 * bits - 1)
+            weights *= np.exp(-alpha * Ysign * H)
+            weights /= weights.sum(axis = 0)
+            chosen[:, t], polarities[:, t], alphas[:, t] = best, polarity, alpha
+
+        writeCacheFile(npzPath(paramsFile), lambda file: \
+                       np.savez(file, pairs = pairs[chosen], polarities = polarities,
+                                alphas = alphas.astype(np.float32)))
+
+    def signedSums(self, packed, V, numPairs):
+        '''
+        returns (numPairs x 4) array: the sums of the columns of V over the images
+        whose comparison f holds, i.e. F.T.dot(V) for the unpacked bit matrix F
+        '''
+        sums = np.zeros((numPairs, V.shape[1]))
+        for start in range(0, len(packed), self.blockSize):
+            F = np.unpackbits(packed[start:start + self.blockSize], axis = 1, count = numPairs)
+            sums += F.T.dot(V[start:start + len(F)])
+        return sums
+
+    def predict(self, testData, paramsFile):
+        '''
+        returns predictions of orientation for each test image
+
+        Input:
+            testData - list of Thumbnail
+            paramsFile - file written by train()
+
+        Output:
+            list of Prediction; the weights of each are the 4 boosters' scores
+        '''
+        params = readNpz(npzPath(paramsFile))
+        pairs, polarities, alphas = params['pairs'], params['polarities'], params['alphas']
+        pixels = pixelMatrix(testData)
+        scores = np.empty((len(pixels), len(alphas)))
+        for start in range(0, len(pixels), self.blockSize):
+            X = pixels[start:start + self.blockSize]
+            for c in range(len(alphas)):
+                H = np.where(X[:, pairs[c, :, 0]] > X[:, pairs[c, :, 1]], 1.0, -1.0)
+                scores[start:start + len(X), c] = H.dot(polarities[c] * alphas[c])
+        winners = np.argmax(scores, axis = 1)
+        return [Prediction(testData[i].photoId, dPrediction[winners[i]], scores[i]) \
+                for i in range(len(winners))]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Pins the BLAS thread pool of a process to a single thread
+
+The BLAS library sizes its thread pool from environment variables when numpy
+is first imported, so a script that trains on several processes must call
+pinBlasThreads() before it imports numpy or any module that does. Child
+processes inherit the variables. Without pinning, every worker would start
+one BLAS thread per core and the workers would compete for the cores.
+
+@author: cfalter
+"""
+import os
+
+threadVariables = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                   "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+def pinBlasThreads():
+    '''
+    sets the thread count of every common BLAS library to 1; has no effect on
+    a numpy that has already been imported
+    '''
+    for variable in threadVariables:
+        os.environ[variable] = "1"
+
+def pinBlasThreadsForWorkers(args):
+    '''
+    calls pinBlasThreads() if the name=value arguments args ask for more than
+    one worker process, e.g. workers=4
+    '''
+    for arg in args:
+        name, _, value = arg.partition('=')
+        if name == "workers" and value.isdigit() and int(value) > 1:
+            pinBlasThreads()
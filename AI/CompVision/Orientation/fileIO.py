@@ -1,28 +1,171 @@
+import hashlib
+import json
+import os
+import struct
+import zipfile
 import numpy as np
-from Prediction import Orientation
-from DataFormats import Thumbnail
+from itertools import islice
+from DataFormats import ThumbnailSet, normalizeRows
 
-def readImages(imageFile):
+def readImages(imageFile, chunkSize = 8192):
     '''
-    returns a numpy array of Thumbnail extracted from imageFile
+    returns a ThumbnailSet of the images in imageFile
+    
+    The file is parsed chunkSize lines at a time: the pixel values of a whole
+    chunk are converted to a uint8 matrix by one call to np.fromstring,
+    rather than one int() call per value
+    '''
+    photoIds, orientations, pixelChunks = [], [], []
+    with open(imageFile, 'r') as file:
+        while True:
+            lines = list(islice(file, chunkSize))
+            if not lines:
+                break
+            fields = [line.split(None, 2) for line in lines if line.strip()]
+            if not fields:
+                continue
+            pixels = np.fromstring(' '.join([f[2] for f in fields]), dtype = np.uint8, sep = ' ')
+            if pixels.size % len(fields) != 0:
+                raise ValueError("Images in " + imageFile + " do not all have the same number of pixel values")
+            photoIds += [f[0] for f in fields]
+            orientations += [int(f[1]) for f in fields]
+            pixelChunks.append(pixels.reshape(len(fields), -1))
+    
+    return ThumbnailSet(np.array(photoIds), np.array(orientations, dtype = np.int16), 
+                        np.vstack(pixelChunks) if pixelChunks else np.empty((0, 192), dtype = np.uint8))
+
+# binary image cache layout; bump cacheFormatVersion whenever the layout changes
+cacheFormatVersion = 1
+cacheHeaderFile = 'cache.json'
+cacheArrayFiles = {'photoIds': 'photoIds.npy',
+                   'orientations': 'orientations.npy',
+                   'pixels': 'pixels.npy'}
+normalizedFilePrefix = 'normalized-'
+
+def fileHash(path):
+    '''
+    returns the SHA-1 hex digest of the file at path
     '''
-    #def __init__(self, photoId, orientation, pixelArray):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def readImagesCached(imageFile, cacheDir = None, dtype = None):
+    '''
+    returns a ThumbnailSet of the images in imageFile, backed by a binary cache
     
-    images = []
-    orientations = {0 : Orientation.UP, 90 : Orientation.RIGHT, \
-                    180 : Orientation.DOWN, 270 : Orientation.LEFT}
+    The first call parses imageFile and writes its arrays as .npy files to
+    cacheDir (default: imageFile + '.cache'). Later calls memory-map those
+    files read-only, so loading is nearly free and concurrent runs share the
+    pages. The cache is reused while imageFile keeps its size and modification
+    time, or failing that its SHA-1 hash; otherwise it is rebuilt.
     
-    with open(imageFile, 'r') as file:
-        for row, data in enumerate(file):
-            values = data.split()
-            
-            photoId = values[0]
-            orientation = orientations[int(values[1])]
-            pixelArray = np.array([int(x) for x in values[2:]])
-            
-            images.append(Thumbnail(photoId, orientation, pixelArray))
-
-    return images    
+    dtype - if given, the normalized pixels (see normalizeRows) are cached as
+            well, as a float matrix of this type, and memory-mapped into the
+            normalizedPixels of the ThumbnailSet
+    '''
+    cacheDir = cacheDir or imageFile + '.cache'
+    headerPath = os.path.join(cacheDir, cacheHeaderFile)
+    stat = os.stat(imageFile)
+    header = None
+    if os.path.exists(headerPath):
+        with open(headerPath, 'r') as file:
+            header = json.load(file)
+        if header.get('version') != cacheFormatVersion or header.get('size') != stat.st_size:
+            header = None
+    
+    if header is not None and header.get('mtime') != stat.st_mtime_ns:
+        # the file was touched; its contents may still be the same
+        if header.get('sha1') == fileHash(imageFile):
+            header['mtime'] = stat.st_mtime_ns
+            writeCacheFile(headerPath, lambda file: writeJson(file, header))
+        else:
+            header = None
+    
+    if header is None:
+        images = readImages(imageFile)
+        os.makedirs(cacheDir, exist_ok = True)
+        for fileName in os.listdir(cacheDir):
+            if fileName.startswith(normalizedFilePrefix):
+                os.remove(os.path.join(cacheDir, fileName))
+        for name, fileName in cacheArrayFiles.items():
+            array = getattr(images, name)
+            writeCacheFile(os.path.join(cacheDir, fileName), lambda file: np.save(file, array))
+        header = {'version': cacheFormatVersion, 'size': stat.st_size, 
+                  'mtime': stat.st_mtime_ns, 'sha1': fileHash(imageFile)}
+        # the header is written last, so readers never see it with stale arrays
+        writeCacheFile(headerPath, lambda file: writeJson(file, header))
+    
+    arrays = {name: np.load(os.path.join(cacheDir, fileName), mmap_mode = 'r')
+              for name, fileName in cacheArrayFiles.items()}
+    normalized = None
+    if dtype is not None:
+        normalizedPath = os.path.join(cacheDir, normalizedFilePrefix + np.dtype(dtype).name + '.npy')
+        if not os.path.exists(normalizedPath):
+            pixels = arrays['pixels']
+            matrix = normalizeRows(pixels, out = np.empty(pixels.shape, dtype))
+            writeCacheFile(normalizedPath, lambda file: np.save(file, matrix))
+            del matrix
+        normalized = np.load(normalizedPath, mmap_mode = 'r')
+    return ThumbnailSet(arrays['photoIds'], arrays['orientations'], arrays['pixels'], normalized)
+
+def writeCacheFile(path, write):
+    '''
+    calls write(file) on a temporary file, then atomically moves it to path
+    '''
+    temporaryPath = path + '.' + str(os.getpid()) + '.tmp'
+    with open(temporaryPath, 'wb') as file:
+        write(file)
+    os.replace(temporaryPath, path)
+
+def writeJson(file, obj):
+    file.write(json.dumps(obj).encode('utf-8'))
+
+def npzPath(path):
+    '''
+    returns path with a .npz extension, as np.savez would name it
+    '''
+    return path if path.endswith('.npz') else path + '.npz'
+
+def readNpz(path, mmap = False):
+    '''
+    returns a dict of the arrays in a .npz file, which is never unpickled
+    
+    mmap - if True, the arrays are read-only memory maps into the file
+    '''
+    if mmap:
+        return mapNpz(path)
+    with np.load(path, allow_pickle = False) as npz:
+        return {name: npz[name] for name in npz.files}
+
+def mapNpz(path):
+    '''
+    returns a dict of read-only memory maps of the arrays in an uncompressed
+    .npz file; np.load() ignores mmap_mode for .npz files
+    '''
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as file:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(path + " is compressed and cannot be memory-mapped")
+            # skip the local file header, whose extra field may differ from the directory's
+            file.seek(info.header_offset + 26)
+            nameLength, extraLength = struct.unpack('<HH', file.read(4))
+            file.seek(info.header_offset + 30 + nameLength + extraLength)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortranOrder, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortranOrder, dtype = np.lib.format.read_array_header_2_0(file)
+            name = info.filename[:-len('.npy')]
+            if shape == () or 0 in shape:
+                arrays[name] = np.lib.format.read_array(archive.open(info))
+            else:
+                arrays[name] = np.memmap(path, dtype, 'r', file.tell(), shape, \
+                                         'F' if fortranOrder else 'C')
+    return arrays
 
 def writePredictions(predictions, outputFile):
     '''
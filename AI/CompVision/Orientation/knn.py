@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+K-nearest-neighbour classifier for orient.py's "nearest" model
+
+Distances between the (N x 192) pixel matrices of the test and training
+images are computed block by block with the identity
+||q - p||^2 = ||q||^2 + ||p||^2 - 2 q.p, so each block is one matrix product
+that fits in cache, and the k nearest candidates of every test image are kept
+with argpartition as the training blocks stream by.
+
+@author: Alex DeCourcy, Anthony Duer, Chris Falter
+"""
+import numpy as np
+from Prediction import Prediction
+from fileIO import writeCacheFile, npzPath, readNpz
+from nn import pixelMatrix, orientationValues, dPosition, dPrediction
+
+class KNN():
+
+    def __init__(self, k = 9, blockSize = 1024, mmap = True):
+        '''
+        Input:
+            k - number of nearest training images that vote on the orientation
+                of a test image
+            blockSize - number of test images, and of training images, whose
+                        distances are computed in one matrix product
+            mmap - if True, predict() memory-maps the uint8 training pixels from
+                   paramsFile instead of reading them into memory
+        '''
+        self.k = k
+        self.blockSize = blockSize
+        self.mmap = mmap
+
+    def train(self, trainData, paramsFile):
+        '''
+        KNN has nothing to optimize; this function writes the training images to
+        paramsFile (.npz is appended if missing) as a uint8 pixel matrix, their
+        orientation positions and the squared norms of their pixel vectors
+        '''
+        pixels = np.ascontiguousarray(pixelMatrix(trainData), dtype = np.uint8)
+        positions = np.array([dPosition[y] for y in orientationValues(trainData)], dtype = np.int8)
+        norms = np.einsum('ij,ij->i', pixels, pixels, dtype = np.float32)
+        writeCacheFile(npzPath(paramsFile), lambda file: \
+                       np.savez(file, pixels = pixels, positions = positions, norms = norms))
+
+    def predict(self, testData, paramsFile):
+        '''
+        returns predictions of orientation for each test image: the orientation
+        most common among its k nearest training images, with ties going to the
+        orientation of the nearest one
+
+        Input:
+            testData - list of Thumbnail
+            paramsFile - file written by train()
+
+        Output:
+            list of Prediction; the weights of each are the fractions of the
+            votes won by the 4 orientations
+        '''
+        params = readNpz(npzPath(paramsFile), self.mmap)
+        neighbors = self.nearestNeighbors(pixelMatrix(testData), params['pixels'], params['norms'])
+        labels = np.asarray(params['positions'])[neighbors]
+        votes = np.sum(labels[:, :, np.newaxis] == np.arange(4), axis = 1)
+        nearest = labels[:, :1] == np.arange(4)
+        winners = np.argmax(2 * votes + nearest, axis = 1)
+        weights = votes / float(neighbors.shape[1])
+        return [Prediction(testData[i].photoId, dPrediction[winners[i]], weights[i]) \
+                for i in range(len(winners))]
+
+    def nearestNeighbors(self, queries, points, pointNorms):
+        '''
+        returns (len(queries) x k) array: indices of the k points nearest to each
+        query, nearest first
+
+        Input:
+            queries - (n x 192) array of test pixels
+            points - (N x 192) array of training pixels
+            pointNorms - squared norms of the rows of points
+        '''
+        k = min(self.k, len(points))
+        neighbors = np.empty((len(queries), k), dtype = np.intp)
+        for start in range(0, len(queries), self.blockSize):
+            Q = np.asarray(queries[start:start + self.blockSize], dtype = np.float32)
+            bestDistances = np.empty((len(Q), 0), dtype = np.float32)
+            bestIndices = np.empty((len(Q), 0), dtype = np.intp)
+            for pointStart in range(0, len(points), self.blockSize):
+                P = np.asarray(points[pointStart:pointStart + self.blockSize], dtype = np.float32)
+                # ||q||^2 is the same for every point, so ranking needs only ||p||^2 - 2 q.p
+                distances = Q.dot(P.T)
+                distances *= -2
+                distances += pointNorms[pointStart:pointStart + len(P)]
+                indices = np.broadcast_to(np.arange(pointStart, pointStart + len(P)), distances.shape)
+                bestDistances = np.concatenate((bestDistances, distances), axis = 1)
+                bestIndices = np.concatenate((bestIndices, indices), axis = 1)
+                if bestDistances.shape[1] > k:
+                    top = np.argpartition(bestDistances, k - 1, axis = 1)[:, :k]
+                    bestDistances = np.take_along_axis(bestDistances, top, axis = 1)
+                    bestIndices = np.take_along_axis(bestIndices, top, axis = 1)
+            order = np.argsort(bestDistances, axis = 1, kind = 'stable')
+            neighbors[start:start + len(Q)] = np.take_along_axis(bestIndices, order, axis = 1)
+        return neighbors
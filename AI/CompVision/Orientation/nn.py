@@ -1,85 +1,307 @@
 from Prediction import Prediction, Orientation
-from DataFormats import Thumbnail
+from DataFormats import ThumbnailSet, normalizeRows
+from fileIO import writeCacheFile, npzPath, readNpz
+import json
+import os
 import numpy as np
-from sklearn.utils import shuffle
 from activations import Activation
+from optimizers import SGD
+from nnMetrics import PhaseTimer, timed
+import time
+from nnParallel import ParallelTrainer, layerViews
 
 dPosition = {Orientation.UP.value: 0, Orientation.RIGHT.value: 1, \
              Orientation.DOWN.value: 2, Orientation.LEFT.value: 3}
 dPrediction = {0:Orientation.UP, 1:Orientation.RIGHT, 2:Orientation.DOWN, 3:Orientation.LEFT}
 
+checkpointFormatVersion = 1
+
+def pixelMatrix(data):
+    '''
+    returns the (N x 192) pixel matrix of a ThumbnailSet or a list of Thumbnail
+    '''
+    if isinstance(data, ThumbnailSet):
+        return data.pixels
+    return np.array([t.pixelArray for t in data])
+
+def orientationValues(data):
+    '''
+    returns the orientation values (0, 90, 180, 270) of a ThumbnailSet or a list of Thumbnail
+    '''
+    if isinstance(data, ThumbnailSet):
+        return data.orientations.tolist()
+    return [t.orientation.value for t in data]
+
+def writeCheckpoint(paramsFile, Ws, Bs, metadata):
+    '''
+    atomically writes weights, biases and metadata to an uncompressed .npz file
+    
+    Inputs:
+        paramsFile - checkpoint file; .npz is appended if missing
+        Ws, Bs - lists of weight and bias arrays, stored as W0, W1, ... and B0, B1, ...
+        metadata - dict of JSON-serializable values, stored as a JSON string so
+                   that loading never needs pickle
+    '''
+    arrays = {'W' + str(i): W for i, W in enumerate(Ws)}
+    arrays.update({'B' + str(i): B for i, B in enumerate(Bs)})
+    arrays['metadata'] = np.array(json.dumps(dict(metadata, version = checkpointFormatVersion)))
+    writeCacheFile(npzPath(paramsFile), lambda file: np.savez(file, **arrays))
+
+def readCheckpoint(paramsFile, mmap = False):
+    '''
+    returns 3 values: list of weight arrays, list of bias arrays, metadata dict
+    
+    Inputs:
+        paramsFile - checkpoint file written by writeCheckpoint()
+        mmap - if True, the arrays are read-only memory maps into the file
+    '''
+    path = npzPath(paramsFile)
+    arrays = readNpz(path, mmap)
+    metadata = json.loads(str(arrays['metadata']))
+    if metadata.get('version') != checkpointFormatVersion:
+        raise ValueError(path + " is not a version " + str(checkpointFormatVersion) + " checkpoint")
+    numLayers = len(metadata['hidden']) + 1
+    return [arrays['W' + str(i)] for i in range(numLayers)], \
+           [arrays['B' + str(i)] for i in range(numLayers)], metadata
+
+class Gradients():
+    '''
+    Preallocated weight and bias gradients of a network. Their shapes do not
+    depend on the batch size, so all BatchBuffers of a network share them.
+    If flat is given, the gradients are views of this 1-d array, laid out as
+    W0, B0, W1, B1, ...
+    '''
+    def __init__(self, Ws, Bs, flat = None):
+        if flat is None:
+            self.deltas = [np.empty(W.shape, W.dtype) for W in Ws]
+            self.errors = [np.empty(B.shape, B.dtype) for B in Bs]
+        else:
+            views = layerViews(flat, [shape for W, B in zip(Ws, Bs) for shape in (W.shape, B.shape)])
+            self.deltas, self.errors = views[0::2], views[1::2]
+        self.Wout = np.empty(Ws[-1].shape, Ws[-1].dtype) # output weights + bias, see forward()
+
+class BatchBuffers():
+    '''
+    Preallocated activations and errors for the forward and backward pass over
+    mini-batches of one fixed size
+    '''
+    def __init__(self, batchSize, numFeatures, hidden, numOutputs, gradients, dtype = np.float64):
+        self.size = batchSize
+        self.I = np.empty((batchSize, numFeatures), dtype)
+        self.Ygt = np.empty((batchSize, numOutputs), dtype)
+        self.Zs = [np.empty((batchSize, n), dtype) for n in hidden]
+        self.As = [np.empty((batchSize, n), dtype) for n in hidden]
+        self.Ds = [np.empty((batchSize, n), dtype) for n in hidden] # activation derivatives
+        self.Es = [np.empty((batchSize, n), dtype) for n in hidden + [numOutputs]]
+        self.Yhat = np.empty((batchSize, numOutputs), dtype)
+        self.sums = np.empty((batchSize, 1), dtype)
+        self.gradients = gradients
+
 class NeuralNet():
     
-    def __init__(self, atype, hidden):
+    def __init__(self, atype, hidden, epochs = 1500, batchSize = 10, tolerance = 0.06, \
+                 maxUnimprovedEpochs = 100, chunkSize = 1024, dtype = np.float64, \
+                 workers = 1, hogwild = False, optimizer = None, metrics = None):
         '''
         Input:
             atype - Tanh, Relu, or Sigmoid
             hidden - list of hidden layer sizes. E.g., [192, 128, 64] specifies
                      3 hidden layers with 192, 128, and 64 nodes each
+            epochs - maximum number of training epochs
+            batchSize - number of observations per mini-batch
+            tolerance - amount val-loss must be better than bestLoss to become bestLoss
+            maxUnimprovedEpochs - training stops after this many epochs without
+                                  a new bestLoss
+            chunkSize - number of observations per chunk when forward() runs
+                        for validation or prediction
+            dtype - float type of weights, inputs and activations; np.float32
+                    halves memory traffic and speeds up the matrix products
+            workers - number of processes that train in parallel (see
+                      nnParallel.ParallelTrainer); with workers > 1, batchSize is
+                      the global mini-batch that the workers split among them
+            hogwild - if True, the workers train on their own shares of the data
+                      and update the shared weights without synchronizing
+            optimizer - SGD, Momentum, RMSProp or Adam from optimizers.py;
+                        defaults to SGD with the activation's learning rate
+            metrics - optional function that train() calls after every epoch
+                      with a dict of phase timings, throughput and peak memory
+                      (see nnMetrics.py), e.g. nnMetrics.JsonLinesWriter
         '''
         self.activation = Activation(atype)
         self.hidden = hidden
+        self.epochs = epochs
+        self.batchSize = batchSize
+        self.tolerance = tolerance
+        self.maxUnimprovedEpochs = maxUnimprovedEpochs
+        self.chunkSize = chunkSize
+        self.dtype = np.dtype(dtype)
+        self.workers = workers
+        self.hogwild = hogwild
+        self.optimizer = optimizer if optimizer is not None else SGD()
+        self.metrics = metrics
     
-    def train(self, trainData, validationData, paramsFile):
+    def train(self, trainData, validationData, paramsFile, resume = False):
         '''
         optimizes a model to prediction orientation of images
         
         Input:
             trainData - list of Thumbnail
-            paramsFile - file to which this function writes optimized hyperparameters/weights
+            paramsFile - checkpoint file (.npz) to which this function writes the
+                         weights each time the validation loss improves
+            resume - if True and paramsFile exists, training continues from the
+                     weights and epoch stored in it
         
         Output:
-            Method does not return a value; instead, it writes to paramsFile
+            Method does not return a value; instead, it writes to paramsFile.
+            The validation loss and accuracy of each epoch are kept in self.history.
         '''
+        self.history = []
         self.initTrainParams(trainData, validationData)
+        firstEpoch = 0
+        if resume and os.path.exists(npzPath(paramsFile)):
+            firstEpoch = self.loadCheckpoint(paramsFile)['epoch'] + 1
         # find loss of randomized NN so we can verify that training works
         Y_pred, _ = self.forward(self.Xvalidate)
         bestLoss = self.loss(self.Yvalidate, Y_pred)
-        bestWs = None
-        bestBs = None
         accuracy = self.accuracy(self.Yvalidate, Y_pred)
         self.printLoss("pre", bestLoss, accuracy)
+        if firstEpoch == 0:
+            self.saveCheckpoint(paramsFile, -1, bestLoss, accuracy)
 
-        epochs = 1500
-        batchSize = 10 # use mini-batch gradient descent
-        tolerance = 0.06 # amount val-loss must be better than bestLoss to become bestLoss
-        maxUnimprovedEpochs = 100
         unimprovedEpochs = 0
-        numObservations = len(self.X)
-        for epoch in range(epochs):
-            # shuffle data
-            X, Y = shuffle(self.X, self.Y)
-            i, j = 0, 0
-            for i in range(0, numObservations - batchSize, batchSize):
-                j += batchSize
+        trainer = ParallelTrainer(self, self.workers, self.hogwild) if self.workers > 1 else None
+        if trainer is None:
+            buffers, lastBuffers = self.initTrainBuffers()
+        timer = PhaseTimer() if self.metrics is not None else None
+        try:
+            for epoch in range(firstEpoch, self.epochs):
+                # shuffle data
+                with timed(timer, "shuffle"):
+                    order = np.random.permutation(len(self.X))
+                if trainer is None:
+                    self.trainEpoch(order, epoch, buffers, lastBuffers, timer)
+                else:
+                    trainer.trainEpoch(order, epoch, timer)
+                
+                # check validation loss
+                with timed(timer, "validation"):
+                    Yhat_V, _ = self.forward(self.Xvalidate)
+                    validationLoss = self.loss(self.Yvalidate, Yhat_V)
+                    validationAccuracy = self.accuracy(self.Yvalidate, Yhat_V)
+                self.printLoss(epoch, validationLoss, validationAccuracy)
+                improved = validationLoss + self.tolerance < bestLoss
+                if improved:
+                    with timed(timer, "checkpoint"):
+                        self.saveCheckpoint(paramsFile, epoch, validationLoss, validationAccuracy)
+                    bestLoss = validationLoss
+                    unimprovedEpochs = 0
+                else:
+                    unimprovedEpochs += 1
+                if timer is not None:
+                    self.metrics(timer.record(epoch, len(order), loss = float(validationLoss),
+                                              accuracy = float(validationAccuracy)))
+                if not improved and unimprovedEpochs >= self.maxUnimprovedEpochs:
+                    break
+        finally:
+            if trainer is not None:
+                trainer.close()
+    
+    def saveCheckpoint(self, paramsFile, epoch, loss, accuracy):
+        '''
+        writes a snapshot of the current weights, the architecture and the
+        validation results of epoch (-1 before training) to paramsFile
+        '''
+        metadata = {'activation': self.activation.name(), 'hidden': list(self.hidden),
+                    'dtype': self.dtype.name, 'optimizer': self.optimizer.name(),
+                    'epoch': epoch, 'loss': float(loss),
+                    'accuracy': float(accuracy)}
+        writeCheckpoint(paramsFile, self.Ws, self.Bs, metadata)
+    
+    def loadCheckpoint(self, paramsFile, mmap = False):
+        '''
+        replaces the weights with those in paramsFile, converted to self.dtype,
+        and returns the checkpoint's metadata
+        
+        mmap - if True, weights of the same dtype stay read-only memory maps
+        '''
+        Ws, Bs, metadata = readCheckpoint(paramsFile, mmap)
+        if metadata['activation'] != self.activation.name() or metadata['hidden'] != list(self.hidden):
+            raise ValueError(paramsFile + " holds a " + metadata['activation'] + " network with hidden layers " + \
+                             str(metadata['hidden']))
+        self.Ws = [W.astype(self.dtype, copy = False) for W in Ws]
+        self.Bs = [B.astype(self.dtype, copy = False) for B in Bs]
+        return metadata
+        
+    def trainEpoch(self, order, epoch, buffers = None, lastBuffers = None, timer = None):
+        '''
+        runs one epoch of mini-batch gradient descent over the training data
+        
+        Input:
+            order - permutation of the training observations; mini-batches are
+                    gathered from self.X and self.Y in this order
+            epoch - int representing which training loop
+            buffers, lastBuffers - BatchBuffers for the full mini-batches and for
+                the last mini-batch, from initTrainBuffers(); if omitted, each
+                mini-batch allocates new arrays
+            timer - optional nnMetrics.PhaseTimer that accumulates the time spent
+                    gathering ("shuffle"), in forward() and in backprop()
+        '''
+        numObservations = len(order)
+        for i in range(0, numObservations, self.batchSize):
+            batch = order[i:i + self.batchSize]
+            batchBuffers = buffers if len(batch) == self.batchSize else lastBuffers
+            if timer is None:
+                X, Y = self.gatherBatch(batch, batchBuffers)
                 # forward
-                self.I = X[i:i + batchSize]
-                Yhat, hidden = self.forward(self.I)
+                Yhat, hidden = self.forward(X, True, batchBuffers)
                 # backprop
-                self.backprop(Y[i:i + batchSize], Yhat, hidden, epoch)
-                    
-            # last mini-batch
-            i += 10
-            self.I = X[i:numObservations]
-            Yhat, Z = self.forward(self.I)
-            self.backprop(Y[i:numObservations], Yhat, Z, epoch)
-            
-            # check validation loss
-            Yhat_V, _ = self.forward(self.Xvalidate)
-            validationLoss = self.loss(self.Yvalidate, Yhat_V)
-            validationAccuracy = self.accuracy(self.Yvalidate, Yhat_V)
-            self.printLoss(epoch, validationLoss, validationAccuracy)
-            if validationLoss + tolerance < bestLoss:
-                bestWs = self.Ws
-                bestBs = self.Bs
-                bestLoss = validationLoss
-                unimprovedEpochs = 0
+                self.backprop(Y, Yhat, hidden, epoch, batchBuffers)
             else:
-                unimprovedEpochs += 1
-                if unimprovedEpochs >= maxUnimprovedEpochs:
-                    break
-        # save params to file
-        np.save(paramsFile, [bestWs, bestBs])
+                start = time.perf_counter()
+                X, Y = self.gatherBatch(batch, batchBuffers)
+                gathered = time.perf_counter()
+                Yhat, hidden = self.forward(X, True, batchBuffers)
+                forwarded = time.perf_counter()
+                self.backprop(Y, Yhat, hidden, epoch, batchBuffers)
+                timer.add("shuffle", gathered - start)
+                timer.add("forward", forwarded - gathered)
+                timer.add("backprop", time.perf_counter() - forwarded)
+    
+    def gatherBatch(self, batch, buffers = None):
+        '''
+        returns the observations and indicator arrays at the indices in batch,
+        copied into the input arrays of buffers if given
+        '''
+        if buffers is None:
+            return self.X[batch], self.Y[batch]
+        np.take(self.X, batch, axis = 0, out = buffers.I, mode = 'clip')
+        np.take(self.Y, batch, axis = 0, out = buffers.Ygt, mode = 'clip')
+        return buffers.I, buffers.Ygt
+    
+    def initTrainBuffers(self):
+        '''
+        returns 2 BatchBuffers: one for the full mini-batches of an epoch and one
+        for its last mini-batch, which holds the remaining observations when the
+        batch size does not divide the number of observations
+        '''
+        lastSize = len(self.X) % self.batchSize
+        gradients = self.initGradients()
+        buffers = self.initBatchBuffers(self.batchSize, gradients)
+        if lastSize == 0:
+            return buffers, buffers
+        return buffers, self.initBatchBuffers(lastSize, gradients)
+    
+    def initGradients(self, flat = None):
+        '''
+        returns Gradients shaped like the weights, optionally views of flat
+        '''
+        return Gradients(self.Ws, self.Bs, flat)
+    
+    def initBatchBuffers(self, batchSize, gradients):
+        '''
+        returns BatchBuffers for mini-batches of batchSize observations
+        '''
+        return BatchBuffers(batchSize, self.X.shape[1], self.hidden, self.O, gradients, self.dtype)
         
     def initTrainParams(self, trainData, validationData):
         # architecture
@@ -90,13 +312,14 @@ class NeuralNet():
         # weights + bias neurons
         self.Ws = []
         self.Bs = [] 
-        self.Ws.append(self.activation.initializeWeights(numFeatures, self.hidden[0], numHidden + 1))
-        self.Bs.append(np.zeros(self.hidden[0]))       
+        self.Ws.append(self.activation.initializeWeights(numFeatures, self.hidden[0], numHidden + 1, self.dtype))
+        self.Bs.append(np.zeros(self.hidden[0], self.dtype))       
         for i in range(1, numHidden):
-            self.Ws.append(self.activation.initializeWeights(self.hidden[i-1], self.hidden[i], numHidden + 1))
-            self.Bs.append(np.zeros(self.hidden[i]))
-        self.Ws.append(self.activation.initializeWeights(self.hidden[i], self.O, numHidden + 1))
-        self.Bs.append(np.zeros(self.O))
+            self.Ws.append(self.activation.initializeWeights(self.hidden[i-1], self.hidden[i], numHidden + 1, self.dtype))
+            self.Bs.append(np.zeros(self.hidden[i], self.dtype))
+        self.Ws.append(self.activation.initializeWeights(self.hidden[i], self.O, numHidden + 1, self.dtype))
+        self.Bs.append(np.zeros(self.O, self.dtype))
+        self.optimizer.initialize(self.activation, self.Ws, self.Bs)
         
         # input data and neuron activations will be assigned during training
         self.I =  None 
@@ -104,10 +327,22 @@ class NeuralNet():
         self.Zs = []
         
         # training data
-        self.X = np.array([trainData[i].normalize() for i in range(len(trainData))])
-        self.Y = np.array([self.indicatorArray(trainData[i].orientation.value) for i in range(len(trainData))])
-        self.Xvalidate = np.array([validationData[i].normalize() for i in range(len(validationData))])
-        self.Yvalidate = np.array([self.indicatorArray(validationData[i].orientation.value) for i in range(len(validationData))])
+        self.X = self.inputMatrix(trainData)
+        self.Y = self.indicatorMatrix(orientationValues(trainData))
+        self.Xvalidate = self.inputMatrix(validationData)
+        self.Yvalidate = self.indicatorMatrix(orientationValues(validationData))
+    
+    def inputMatrix(self, data):
+        '''
+        returns the normalized pixels of data as a (N x 192) array of self.dtype;
+        the normalizedPixels of a ThumbnailSet are returned as they are, without
+        a copy, if they have self.dtype
+        '''
+        if isinstance(data, ThumbnailSet) and data.normalizedPixels is not None \
+           and data.normalizedPixels.dtype == self.dtype:
+            return data.normalizedPixels
+        pixels = pixelMatrix(data)
+        return normalizeRows(pixels, out = np.empty(pixels.shape, self.dtype))
         
     def predict(self, testData, paramsFile):
         '''
@@ -120,20 +355,17 @@ class NeuralNet():
         Output:
             list of Prediction
         '''
-        self.initTestParams()
-        X = np.array([testData[i].normalize() for i in range(len(testData))])
-        Ygt = np.array([self.indicatorArray(testData[i].orientation.value) \
-                        for i in range(len(testData))])
-        Yhat, _ = self.forward(X)
+        self.initTestParams(paramsFile)
+        Ygt = self.indicatorMatrix(orientationValues(testData))
+        # only the uint8 pixels are held in full; each chunk is normalized on its way in
+        Yhat = self.forwardChunks(pixelMatrix(testData), normalize = True)
         accuracy = self.accuracy(Ygt, Yhat)
         predictions = [Prediction(testData[i].photoId, dPrediction[np.argmax(Yhat[i])], Yhat[i]) \
                        for i in range(len(Yhat))]
         return predictions        
 
-    def initTestParams(self):
-        params = np.load("relu.npy")
-        self.Ws = params[0]
-        self.Bs = params[1]
+    def initTestParams(self, paramsFile):
+        self.loadCheckpoint(paramsFile, mmap = True)
         self.I =  None 
         self.As = [] 
         self.Zs = []
@@ -151,17 +383,49 @@ class NeuralNet():
         a[dPosition[y]] = 1
         return a
     
-    def softmax(self, Z):
+    def indicatorMatrix(self, ys):
+        '''
+        returns an array with one indicatorArray() row per orientation value in ys
+        '''
+        positions = np.array([dPosition[y] for y in ys], dtype = np.intp)
+        return np.eye(self.O, dtype = self.dtype)[positions]
+    
+    def softmax(self, Z, out = None, sums = None):
         '''
         returns an array of floats between 0 and 1 representing the softmax 
-        weight of each element in the array
+        weight of each element in the array; the row maximum is subtracted
+        before exponentiating, so large inputs cannot overflow
+        
+        out, sums - optional preallocated arrays for the result and the row sums;
+                    out may be Z itself
         '''
-        A = np.exp(Z)
-        return A / A.sum(axis=1, keepdims=True)
+        if out is None:
+            with np.errstate(under = 'ignore'): # tiny weights may round to 0
+                A = np.exp(Z - Z.max(axis=1, keepdims=True))
+            return A / A.sum(axis=1, keepdims=True)
+        np.max(Z, axis = 1, keepdims = True, out = sums)
+        np.subtract(Z, sums, out = out)
+        with np.errstate(under = 'ignore'):
+            np.exp(out, out = out)
+        np.sum(out, axis = 1, keepdims = True, out = sums)
+        return np.divide(out, sums, out = out)
 
-    def forward(self, X):
-        # TODO: add a boolean parameter to indicate training v. prediction, cache
-        # input data + activations (or not) based on the parameter
+    def forward(self, X, training = False, buffers = None):
+        '''
+        returns 2 arrays: softmax output for X, output of the last hidden layer
+        
+        Input:
+            X - array of observations
+            training - if True, the input and every layer's output are kept in
+                       self.I, self.As and self.Zs (or in buffers) for backprop();
+                       otherwise X is processed in chunks through 2 reusable
+                       buffers, and None is returned for the last hidden layer
+            buffers - optional BatchBuffers used when training
+        '''
+        if not training:
+            return self.forwardChunks(X), None
+        if buffers is not None:
+            return self.forwardBatch(X, buffers)
         self.As.clear()
         self.Zs.clear()
         self.I = X
@@ -174,15 +438,67 @@ class NeuralNet():
         lastHidden = A
         return self.softmax(A.dot(self.Ws[i+1] + self.Bs[i+1])), lastHidden        
     
-    def backprop(self, Ygt, Yhat, H, epoch):
+    def forwardChunks(self, X, normalize = False):
+        '''
+        returns the softmax output for X, computed self.chunkSize observations at
+        a time; hidden layers alternate between 2 buffers sized for one chunk, so
+        memory use beyond the output does not grow with len(X)
+        
+        normalize - if True, X holds raw pixels, and each chunk is normalized
+                    as inputMatrix() does into a buffer sized for one chunk
+        '''
+        numObservations = len(X)
+        chunkSize = max(min(self.chunkSize, numObservations), 1)
+        width = max(W.shape[1] for W in self.Ws[:-1])
+        pingPong = [np.empty(chunkSize * width, self.dtype), np.empty(chunkSize * width, self.dtype)]
+        inputs = np.empty((chunkSize, X.shape[1]), self.dtype) if normalize else None
+        sums = np.empty((chunkSize, 1), self.dtype)
+        Wout = self.Ws[-1] + self.Bs[-1]
+        Yhat = np.empty((numObservations, self.O), self.dtype)
+        for start in range(0, numObservations, chunkSize):
+            Z = X[start:start + chunkSize]
+            n = len(Z)
+            if normalize:
+                Z = normalizeRows(Z, out = inputs[:n])
+            for i in range(len(self.Ws) - 1):
+                # the input of this layer is in pingPong[1] and is no longer
+                # needed once Z has been computed, so A may overwrite it
+                size = n * self.Ws[i].shape[1]
+                out = (pingPong[0][:size].reshape(n, -1), pingPong[1][:size].reshape(n, -1))
+                A, Z = self.activation.activate(Z, self.Ws[i], self.Bs[i], out = out)
+                pingPong.reverse()
+            # output layer
+            chunk = np.dot(A, Wout, out = Yhat[start:start + n])
+            self.softmax(chunk, out = chunk, sums = sums[:n])
+        return Yhat
+    
+    def forwardBatch(self, X, buffers):
+        '''
+        forward() into the preallocated arrays of buffers; computes exactly the
+        same values without allocating
+        '''
+        self.I = X
+        Z = X
+        for i in range(len(self.Ws) - 1):
+            A, Z = self.activation.activate(Z, self.Ws[i], self.Bs[i], \
+                                            out = (buffers.Zs[i], buffers.As[i]))
+        # output layer
+        Wout = np.add(self.Ws[-1], self.Bs[-1], out = buffers.gradients.Wout)
+        Yhat = np.dot(A, Wout, out = buffers.Yhat)
+        return self.softmax(Yhat, out = Yhat, sums = buffers.sums), A
+    
+    def backprop(self, Ygt, Yhat, H, epoch, buffers = None):
         '''
         Ygt - output ground truth
         Yhat - forward prop output
         H - output of the last hidden layer
         epoch - int representing which training loop 
+        buffers - BatchBuffers filled by forward(); if given, gradients are
+                  computed into its arrays and weights are updated in place
         '''
+        if buffers is not None:
+            return self.backpropBatch(Ygt, Yhat, H, epoch, buffers)
         numLayers = len(self.Ws)
-        lr = self.activation.learningRate(epoch)
         
         # CALCULATE ERRORS
         deltas = []
@@ -204,17 +520,60 @@ class NeuralNet():
         errors.insert(0, np.sum(E, axis = 0))
 
         ## ADJUST WEIGHTS + BIAS
-        for i in range(len(self.Ws)):
-            self.Ws[i] -= lr * deltas[i]
-            self.Bs[i] -= self.activation.biasFactor() * lr * errors[i]
+        self.optimizer.step(self.Ws, self.Bs, deltas, errors, epoch, len(Ygt))
+    
+    def backpropBatch(self, Ygt, Yhat, H, epoch, buffers):
+        '''
+        backprop() into the preallocated arrays of buffers; computes exactly the
+        same weight updates without allocating
+        '''
+        self.computeGradients(Ygt, Yhat, H, buffers)
+        self.applyGradients(buffers.gradients, epoch, buffers.size)
+    
+    def computeGradients(self, Ygt, Yhat, H, buffers):
+        '''
+        fills buffers.gradients with the weight and bias gradients of one
+        mini-batch, summed over its observations; the weights are unchanged
+        '''
+        numLayers = len(self.Ws)
+        deltas = buffers.gradients.deltas
+        errors = buffers.gradients.errors
+        
+        # CALCULATE ERRORS
+        # last hidden -> output layer
+        _, E = self.activation.dO(Yhat, Ygt, H, out = (deltas[-1], buffers.Es[-1]))
+        np.sum(E, axis = 0, out = errors[-1])
+        # hidden layers
+        for i in range(numLayers - 2, 0, -1):
+            _, E = self.activation.dAHidden(buffers.As[i-1], buffers.As[i], E, self.Ws[i+1], \
+                                            out = (deltas[i], buffers.Es[i], buffers.Ds[i]))
+            np.sum(E, axis = 0, out = errors[i])
+        # input -> 1st hidden layer
+        _, E = self.activation.dAHidden(self.I, buffers.As[0], E, self.Ws[1], \
+                                        out = (deltas[0], buffers.Es[0], buffers.Ds[0]))
+        np.sum(E, axis = 0, out = errors[0])
+    
+    def applyGradients(self, gradients, epoch, batchSize):
+        '''
+        updates the weights and biases in place with one optimizer step along
+        the mean of gradients, which are sums over batchSize observations;
+        gradients are overwritten
+        '''
+        self.optimizer.step(self.Ws, self.Bs, gradients.deltas, gradients.errors, epoch, batchSize)
     
     def loss(self, Ygt, Yhat):
         ''' 
         Inputs:
             Ygt - ground truth
             Yhat - predicted
+        
+        Only the predicted probability of each true class contributes; it is
+        clipped at the smallest normal float so that a saturated softmax cannot
+        produce log(0), and the logs are summed in float64.
         '''
-        return -np.sum(Ygt * np.log(Yhat))
+        p = np.sum(Ygt * Yhat, axis = 1)
+        np.maximum(p, np.finfo(p.dtype).tiny, out = p)
+        return -np.sum(np.log(p), dtype = np.float64)
     
     def accuracy(self, Ygt, Yhat):
         ''' 
@@ -230,6 +589,7 @@ class NeuralNet():
         
     
     def printLoss(self, epoch, loss, accuracy):
+        self.history.append((epoch, loss, accuracy))
         print(','.join([str(epoch),str(loss), str(accuracy)]))
         
-        
\ No newline at end of file
+        
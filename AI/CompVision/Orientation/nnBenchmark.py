@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Measures NeuralNet training throughput in epochs/sec, with and without the
+preallocated mini-batch buffers, and checks that both produce the same weights
+
+Usage: python nnBenchmark.py activation hidden-layers [epochs [batchSize [dtype]]]
+e.g.   python nnBenchmark.py relu 192,192 5 64 float32
+
+@author: cfalter
+"""
+import sys
+import time
+import copy
+from nn import NeuralNet
+from activations import Tanh, Relu, Sigmoid
+from fileIO import readImagesCached
+import numpy as np
+
+def epochsPerSecond(model, epochs, buffers, lastBuffers):
+    '''
+    Returns the throughput of model.trainEpoch() in epochs per second
+    '''
+    np.random.seed(0)
+    order = [np.random.permutation(len(model.X)) for _ in range(epochs)]
+    start = time.perf_counter()
+    for epoch in range(epochs):
+        model.trainEpoch(order[epoch], epoch, buffers, lastBuffers)
+    return epochs / (time.perf_counter() - start)
+
+def main():
+    activationArg, hiddenArg = sys.argv[1].lower(), sys.argv[2]
+    epochs = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    activation = Tanh() if activationArg == "tanh" else Relu() if activationArg == "relu" else Sigmoid()
+    hidden = [int(sub) for sub in hiddenArg.split(',')]
+    batchSize = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+    dtype = np.dtype(sys.argv[5]) if len(sys.argv) > 5 else np.float64
+
+    np.random.seed(0)
+    allocating = NeuralNet(activation, hidden, batchSize = batchSize, dtype = dtype)
+    allocating.initTrainParams(readImagesCached("train-data.txt"), readImagesCached("test-data.txt"))
+    buffered = copy.deepcopy(allocating)
+    buffers, lastBuffers = buffered.initTrainBuffers()
+
+    results = [("allocating", epochsPerSecond(allocating, epochs, None, None)),
+               ("preallocated buffers", epochsPerSecond(buffered, epochs, buffers, lastBuffers))]
+    for name, rate in results:
+        print(name + ": " + str(round(rate, 2)) + " epochs/sec")
+    same = all(np.array_equal(a, b) for a, b in zip(allocating.Ws + allocating.Bs, buffered.Ws + buffered.Bs))
+    print("Identical weights: " + str(same))
+
+if __name__ == '__main__':
+    main()
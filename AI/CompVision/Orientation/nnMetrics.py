@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Training instrumentation for NeuralNet
+
+A NeuralNet constructed with a metrics callback times the phases of every
+epoch with a PhaseTimer and passes the callback one record per epoch:
+
+    {"epoch": 3, "loss": 812.4, "accuracy": 0.41, "samples": 40000,
+     "epochSeconds": 2.1, "samplesPerSecond": 19047.6, "totalSeconds": 8.5,
+     "phaseSeconds": {"shuffle": 0.3, "forward": 2.9, "backprop": 4.6, ...},
+     "peakMemoryBytes": 301989888}
+
+phaseSeconds are cumulative since training started. "shuffle" includes
+gathering the mini-batches through the permutation; with workers > 1,
+"forward" and "backprop" are replaced by the master's wait for the workers
+("workers") and its weight updates ("update"). peakMemoryBytes is the peak
+resident memory of the training process, or None where it cannot be
+measured. Without a callback no timer exists, and the mini-batch loop only
+checks that it is None.
+
+@author: cfalter
+"""
+import sys
+import json
+import time
+import contextlib
+import ctypes
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+class PhaseTimer():
+
+    def __init__(self):
+        self.seconds = {}
+        self.start = self.lastRecord = time.perf_counter()
+
+    def add(self, phase, seconds):
+        '''
+        adds seconds to the cumulative time of phase
+        '''
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        '''
+        context manager that adds the time spent in its block to phase
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def record(self, epoch, samples, **values):
+        '''
+        returns the metrics record of an epoch that ends now and trained on
+        samples observations; values (e.g. loss, accuracy) are included as is
+        '''
+        now = time.perf_counter()
+        epochSeconds = now - self.lastRecord
+        self.lastRecord = now
+        record = {'epoch': epoch}
+        record.update(values)
+        record.update({'samples': samples, 'epochSeconds': epochSeconds,
+                       'samplesPerSecond': samples / epochSeconds if epochSeconds > 0 else None,
+                       'totalSeconds': now - self.start, 'phaseSeconds': dict(self.seconds),
+                       'peakMemoryBytes': peakMemoryBytes()})
+        return record
+
+def timed(timer, phase):
+    '''
+    returns timer.phase(phase), or a context manager that does nothing if timer is None
+    '''
+    return contextlib.nullcontext() if timer is None else timer.phase(phase)
+
+class ProcessMemoryCounters(ctypes.Structure):
+    _fields_ = [('cb', ctypes.c_ulong), ('PageFaultCount', ctypes.c_ulong),
+                ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+def peakMemoryBytes():
+    '''
+    returns the peak resident memory of this process in bytes, or None if it
+    cannot be measured on this platform
+    '''
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024 # Linux reports KiB
+    if sys.platform == 'win32':
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    return None
+
+class JsonLinesWriter():
+    '''
+    metrics callback that appends each record as one line of JSON to a file
+    '''
+    def __init__(self, path, append = False):
+        '''
+        append - if False, the file is emptied first
+        '''
+        self.path = path
+        if not append:
+            open(path, 'w').close()
+
+    def __call__(self, record):
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(record) + '\n')
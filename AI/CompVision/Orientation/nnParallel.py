@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Data-parallel NeuralNet training on several worker processes
+
+The weights, the training data, the epoch's shuffle order and one gradient
+slot per worker live in a single block of shared memory, so no array is ever
+pickled or copied between processes. In the default synchronous mode each
+mini-batch of batchSize observations is split evenly among the workers; each
+worker writes the summed gradients of its part to its slot, and the master
+adds the slots and takes one gradient descent step on the shared weights.
+The step is the one a single process would take on the whole mini-batch, up
+to floating point rounding. In hogwild mode each worker trains on its own
+share of the epoch with mini-batches of batchSize and updates the shared
+weights directly, without locks (Recht et al., "Hogwild!", 2011).
+
+Every worker should run with a single BLAS thread. nnTrain.py with workers > 1
+and nnParallelBenchmark.py see to this through blasThreads.py; other scripts
+should call blasThreads.pinBlasThreads() before they import numpy.
+
+@author: cfalter
+"""
+from multiprocessing import Process, Barrier
+from threading import BrokenBarrierError
+from multiprocessing.sharedctypes import RawArray
+from nnMetrics import timed
+import numpy as np
+import time
+
+cacheLine = 64 # bytes; gradient slots are padded to whole lines so workers never share one
+
+# commands from the master to the workers
+STOP, STEP, EPOCH = 0, 1, 2
+
+def layerViews(flat, shapes):
+    '''
+    returns a list of arrays with the given shapes that are consecutive views of
+    the 1-d array flat
+    '''
+    views = []
+    offset = 0
+    for shape in shapes:
+        size = int(np.prod(shape))
+        views.append(flat[offset:offset + size].reshape(shape))
+        offset += size
+    return views
+
+class SharedArrays():
+    '''
+    Named numpy arrays in one block of shared memory. Passed to a Process at
+    its start, a SharedArrays refers to the same memory in the new process.
+    '''
+    def __init__(self, specs):
+        '''
+        specs - list of (name, shape, dtype); each array is an attribute
+        '''
+        self.specs = specs
+        self.offsets = []
+        size = 0
+        for _, shape, dtype in specs:
+            self.offsets.append(size)
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            size += -(-nbytes // cacheLine) * cacheLine
+        self.memory = RawArray('b', max(size, 1))
+        self.bindViews()
+
+    def bindViews(self):
+        for (name, shape, dtype), offset in zip(self.specs, self.offsets):
+            count = int(np.prod(shape))
+            setattr(self, name, np.frombuffer(self.memory, dtype, count, offset).reshape(shape))
+
+    def __getstate__(self):
+        return self.specs, self.offsets, self.memory
+
+    def __setstate__(self, state):
+        self.specs, self.offsets, self.memory = state
+        self.bindViews()
+
+class ParallelTrainer():
+    '''
+    Runs the epochs of NeuralNet.train() on worker processes. While the trainer
+    is open, the model's weights and training data are views of shared memory.
+    '''
+    def __init__(self, model, workers, hogwild = False):
+        '''
+        Input:
+            model - NeuralNet after initTrainParams()
+            workers - number of worker processes
+            hogwild - if True, workers update the shared weights without
+                      synchronizing; otherwise every mini-batch is one
+                      synchronized step
+        '''
+        self.model = model
+        self.workers = workers
+        self.hogwild = hogwild
+        self.shapes = [shape for W, B in zip(model.Ws, model.Bs) for shape in (W.shape, B.shape)]
+        numParams = sum(int(np.prod(shape)) for shape in self.shapes)
+        slotSize = -(-numParams * model.dtype.itemsize // cacheLine) * cacheLine // model.dtype.itemsize
+        self.shared = SharedArrays([('params', (numParams,), model.dtype),
+                                    ('X', model.X.shape, model.dtype),
+                                    ('Y', model.Y.shape, model.dtype),
+                                    ('order', (len(model.X),), np.intp),
+                                    ('control', (3,), np.int64),
+                                    ('gradients', (workers, slotSize), model.dtype)])
+        self.shared.X[:] = model.X
+        self.shared.Y[:] = model.Y
+        model.X, model.Y = self.shared.X, self.shared.Y
+        views = layerViews(self.shared.params, self.shapes)
+        for view, array in zip(views, [a for W, B in zip(model.Ws, model.Bs) for a in (W, B)]):
+            view[:] = array
+        model.Ws, model.Bs = views[0::2], views[1::2]
+        # the sum of the workers' slots
+        self.total = np.empty(slotSize, model.dtype)
+        self.gradients = model.initGradients(self.total)
+
+        template = type(model)(model.activation.atype, model.hidden, batchSize = model.batchSize,
+                               dtype = model.dtype, optimizer = model.optimizer)
+        template.O = model.O
+        self.barrier = Barrier(workers + 1)
+        self.processes = [Process(target = runWorker, daemon = True,
+                                  args = (rank, workers, hogwild, template, self.shared, self.shapes, self.barrier))
+                          for rank in range(workers)]
+        for process in self.processes:
+            process.start()
+        self.idle = True
+
+    def trainEpoch(self, order, epoch, timer = None):
+        '''
+        runs one epoch over the training observations in order; same arguments
+        as NeuralNet.trainEpoch(). timer, if given, accumulates the time the
+        master waits for the workers ("workers") and spends on updates ("update")
+        '''
+        self.idle = False
+        self.shared.order[:] = order
+        if self.hogwild:
+            with timed(timer, "workers"):
+                self.command(EPOCH, 0, epoch)
+        elif timer is None:
+            for start in range(0, len(order), self.model.batchSize):
+                self.command(STEP, start, epoch)
+                self.update(epoch, min(self.model.batchSize, len(order) - start))
+        else:
+            for start in range(0, len(order), self.model.batchSize):
+                begin = time.perf_counter()
+                self.command(STEP, start, epoch)
+                finished = time.perf_counter()
+                self.update(epoch, min(self.model.batchSize, len(order) - start))
+                timer.add("workers", finished - begin)
+                timer.add("update", time.perf_counter() - finished)
+        self.idle = True
+
+    def update(self, epoch, batchSize):
+        '''
+        applies the sum of the workers' gradients over a mini-batch of batchSize
+        observations to the shared weights
+        '''
+        np.sum(self.shared.gradients, axis = 0, out = self.total)
+        self.model.applyGradients(self.gradients, epoch, batchSize)
+
+    def command(self, command, start, epoch):
+        '''
+        starts command on all workers and waits until they have finished it
+        '''
+        self.shared.control[:] = command, start, epoch
+        try:
+            self.barrier.wait()
+            if command != STOP:
+                self.barrier.wait()
+        except BrokenBarrierError:
+            raise RuntimeError("A training worker failed; see its traceback above")
+
+    def close(self):
+        '''
+        stops the workers; the model keeps its weights in shared memory
+        '''
+        if self.idle:
+            self.command(STOP, 0, 0)
+        else:
+            self.barrier.abort()
+        for process in self.processes:
+            process.join()
+        self.processes = []
+
+def runWorker(rank, workers, hogwild, model, shared, shapes, barrier):
+    '''
+    Body of a worker process: binds model to the shared weights and data, then
+    carries out the master's commands until it sends STOP
+
+    Inputs:
+        rank - index of this worker, 0 ... workers - 1
+        model - NeuralNet without weights or data
+        shared - SharedArrays of ParallelTrainer
+        shapes - shapes of W0, B0, W1, B1, ... in shared.params
+    '''
+    views = layerViews(shared.params, shapes)
+    model.Ws, model.Bs = views[0::2], views[1::2]
+    model.X, model.Y = shared.X, shared.Y
+    slot = shared.gradients[rank]
+    # hogwild workers apply their own gradients, so they need no shared slot
+    # but keep their own optimizer state
+    gradients = model.initGradients(None if hogwild else slot)
+    if hogwild:
+        model.optimizer.initialize(model.activation, model.Ws, model.Bs)
+    buffers = {} # BatchBuffers by mini-batch size
+    try:
+        while True:
+            barrier.wait()
+            command, start, epoch = (int(value) for value in shared.control)
+            if command == STOP:
+                return
+            if command == STEP:
+                size = min(model.batchSize, len(shared.order) - start)
+                part = -(-size // workers)
+                first, last = min(rank * part, size), min((rank + 1) * part, size)
+                if first < last:
+                    batchGradients(model, shared.order[start + first:start + last], buffers, gradients)
+                else:
+                    slot[:] = 0
+            else:
+                share = -(-len(shared.order) // workers)
+                rows = shared.order[rank * share:(rank + 1) * share]
+                for i in range(0, len(rows), model.batchSize):
+                    batch = rows[i:i + model.batchSize]
+                    batchGradients(model, batch, buffers, gradients)
+                    model.applyGradients(gradients, epoch, len(batch))
+            barrier.wait()
+    except BrokenBarrierError:
+        return # the master gave up
+    except BaseException:
+        barrier.abort()
+        raise
+
+def batchGradients(model, batch, buffers, gradients):
+    '''
+    computes into gradients the gradients of the observations at the indices in
+    batch, reusing the BatchBuffers of the same size
+    '''
+    if len(batch) not in buffers:
+        buffers[len(batch)] = model.initBatchBuffers(len(batch), gradients)
+    batchBuffers = buffers[len(batch)]
+    X, Y = model.gatherBatch(batch, batchBuffers)
+    Yhat, hidden = model.forward(X, True, batchBuffers)
+    model.computeGradients(Y, Yhat, hidden, batchBuffers)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the wall time NeuralNet training needs to reach a target validation
+accuracy with 1, 2, 4, ... worker processes (see nnParallel.py)
+
+Usage: python nnParallelBenchmark.py activation hidden-layers target-accuracy [workers] [name=value ...]
+e.g.   python nnParallelBenchmark.py relu 192,192 0.7 1,2,4,8 batchSize=256 dtype=float32
+Options: any nnTrain.py option but workers, resume and metrics, e.g. hogwild=true
+
+Every run starts from the same random weights and shuffle order. The time
+includes loading the caches and starting the workers; each row of the output
+is workers, seconds, epochs run and whether the target was reached.
+
+@author: cfalter
+"""
+import blasThreads
+blasThreads.pinBlasThreads() # must precede the first import of numpy
+
+import os
+import sys
+import time
+import tempfile
+import contextlib
+from nn import NeuralNet
+from nnTrain import parseOptions
+from activations import activationTypes
+from fileIO import readImagesCached
+import numpy as np
+
+# workers is the benchmark's own positional argument, every run starts from
+# fresh weights and the timed runs write no metrics
+unsupportedOptions = ("workers", "resume", "metrics")
+
+class TargetReached(Exception):
+    pass
+
+def secondsToAccuracy(model, target, paramsFile):
+    '''
+    Returns 3 values: seconds until model's validation accuracy first reaches
+    target (or until training stops), epochs run, whether target was reached
+    '''
+    printLoss = model.printLoss
+    def stopAtTarget(epoch, loss, accuracy):
+        printLoss(epoch, loss, accuracy)
+        if epoch != "pre" and accuracy >= target:
+            raise TargetReached()
+    model.printLoss = stopAtTarget
+    start = time.perf_counter()
+    reached = True
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            model.train(readImagesCached("train-data.txt"), readImagesCached("test-data.txt"), paramsFile)
+        except TargetReached:
+            pass
+        else:
+            reached = False
+    return time.perf_counter() - start, len(model.history) - 1, reached
+
+def main():
+    activationName, hiddenArg, target = sys.argv[1].lower(), sys.argv[2], float(sys.argv[3])
+    args = sys.argv[4:]
+    workerCounts = [int(sub) for sub in args.pop(0).split(',')] if args and '=' not in args[0] else [1, 2, 4]
+    hidden = [int(sub) for sub in hiddenArg.split(',')]
+    unsupported = [arg for arg in args if arg.split('=', 1)[0] in unsupportedOptions]
+    if unsupported:
+        raise ValueError("Option not supported by the benchmark: " + unsupported[0])
+    kwargs = parseOptions(args)
+    np.seterr(all='raise')
+    # build the binary caches before the first timed run
+    readImagesCached("train-data.txt")
+    readImagesCached("test-data.txt")
+
+    print("workers,seconds,epochs,reached")
+    with tempfile.TemporaryDirectory() as outDir:
+        for workers in workerCounts:
+            np.random.seed(0)
+            model = NeuralNet(activationTypes[activationName](), hidden, workers = workers, **kwargs)
+            seconds, epochs, reached = secondsToAccuracy(model, target, os.path.join(outDir, str(workers)))
+            print(','.join(str(value) for value in [workers, round(seconds, 2), epochs, reached]))
+
+if __name__ == '__main__':
+    main()
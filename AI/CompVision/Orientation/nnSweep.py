@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Trains a grid of neural net architectures in parallel and writes one combined
+results table; replaces the sequential nnExperiments.cmd
+
+Usage: python nnSweep.py output-dir [workers] [name=value ...]
+e.g.   python nnSweep.py c:/temp/sweep 8 activations=relu layers=192,192;64,16 dtype=float32
+Options: activations (comma-separated), layers (semicolon-separated hidden layer
+         specs), and any nnTrain.py option but workers, which is passed to
+         every NeuralNet; with resume=true, an interrupted sweep continues
+         from its checkpoints; with metrics=true, every training writes
+         <activation>_<layers>.jsonl
+
+Each worker process runs one training at a time with a single BLAS thread, so
+a sweep over W workers takes roughly 1/W of the sequential time. The training
+and validation sets are converted to their binary caches once, before the pool
+starts, together with their normalized pixels in the sweep's dtype; every
+worker memory-maps the same cache files, so the normalized input matrices are
+shared through the page cache rather than built again by every worker. Every
+training writes its epoch CSV and its checkpoint to output-dir as
+<activation>_<layers>.csv/.npz; the combined table is written to
+output-dir/sweep.csv.
+
+@author: cfalter
+"""
+import blasThreads
+blasThreads.pinBlasThreads() # must precede the first import of numpy
+
+import os
+import sys
+import time
+import contextlib
+from multiprocessing import Pool
+from nn import NeuralNet
+from nnTrain import parseOptions
+from nnMetrics import JsonLinesWriter
+from activations import activationTypes
+from fileIO import readImagesCached
+import numpy as np
+
+trainFile, testFile = "train-data.txt", "test-data.txt"
+
+activationNames = ["tanh", "relu"]
+layerSpecs = [# x-long nets
+              "256,128,64,32,16", "192,64,32,16,8", "192,192,32,32,8", "128,64,32,16,8",
+              "64,32,24,16,8",
+              # long nets
+              "256,96,48,16", "192,64,32,8", "128,64,16,8",
+              # medium nets
+              "256,96,32", "192,64,16", "128,64,16", "96,64,32", "192,192,48",
+              # short nets
+              "256,128", "192,192", "192,64", "64,64", "64,16"]
+
+resultColumns = ["activation", "layers", "bestLoss", "accuracy", "epochs", "seconds"]
+
+def runName(activationName, layerSpec):
+    return activationName + "_" + layerSpec.replace(',', '-')
+
+def trainOne(config):
+    '''
+    Trains one architecture and returns its row of the results table
+
+    Inputs:
+        config - tuple (activation name, hidden layer spec, NeuralNet keyword
+                 arguments, output directory)
+    '''
+    activationName, layerSpec, kwargs, outDir = config
+    np.seterr(all='raise')
+    np.random.seed() # forked workers would otherwise share one random stream
+    hidden = [int(sub) for sub in layerSpec.split(',')]
+    kwargs = dict(kwargs)
+    resume = kwargs.pop("resume", False)
+    name = os.path.join(outDir, runName(activationName, layerSpec))
+    if kwargs.get("metrics", "false").lower() == "true":
+        kwargs["metrics"] = JsonLinesWriter(name + ".jsonl", append = resume)
+    else:
+        kwargs.pop("metrics", None)
+    model = NeuralNet(activationTypes[activationName](), hidden, **kwargs)
+    start = time.perf_counter()
+    with open(name + ".csv", 'w') as csv, contextlib.redirect_stdout(csv):
+        model.train(readImagesCached(trainFile, dtype = model.dtype),
+                    readImagesCached(testFile, dtype = model.dtype), name, resume)
+    seconds = time.perf_counter() - start
+    epochs = [row for row in model.history if row[0] != "pre"]
+    best = min(model.history, key = lambda row: row[1])
+    return [activationName, layerSpec.replace(',', '-'), best[1], best[2], len(epochs), round(seconds, 1)]
+
+def writeResults(rows, resultsFile):
+    with open(resultsFile, 'w') as results:
+        results.write(','.join(resultColumns) + '\n')
+        for row in rows:
+            results.write(','.join(str(value) for value in row) + '\n')
+
+def main():
+    outDir = sys.argv[1]
+    args = sys.argv[2:]
+    workers = int(args.pop(0)) if args and '=' not in args[0] else os.cpu_count()
+    sweepOptions = dict(arg.split('=', 1) for arg in args if arg.split('=', 1)[0] in ("activations", "layers"))
+    names = sweepOptions["activations"].split(',') if "activations" in sweepOptions else activationNames
+    specs = sweepOptions["layers"].split(';') if "layers" in sweepOptions else layerSpecs
+    kwargs = parseOptions([arg for arg in args if arg.split('=', 1)[0] not in sweepOptions])
+    if kwargs.get("workers", 1) > 1:
+        raise ValueError("The sweep already trains one network per process; workers is not supported")
+    os.makedirs(outDir, exist_ok = True)
+
+    # build the binary caches once, so that the workers only memory-map them
+    dtype = kwargs.get("dtype", np.float64)
+    readImagesCached(trainFile, dtype = dtype)
+    readImagesCached(testFile, dtype = dtype)
+
+    configs = [(name, spec, kwargs, outDir) for spec in specs for name in names]
+    rows = []
+    with Pool(min(workers, len(configs))) as pool:
+        for row in pool.imap_unordered(trainOne, configs):
+            rows.append(row)
+            print(','.join(str(value) for value in row))
+    rows.sort(key = lambda row: row[2])
+    writeResults(rows, os.path.join(outDir, "sweep.csv"))
+
+if __name__ == '__main__':
+    main()
@@ -3,31 +3,78 @@
 Harness for training/testing neural net without perturbing source control
 over orient.py
 
+Usage: python nnTrain.py train|test activation hidden-layers [name=value ...]
+e.g.   python nnTrain.py train relu 192,192 batchSize=64 epochs=500
+Options: epochs, batchSize, tolerance, maxUnimprovedEpochs, chunkSize, dtype,
+         workers, hogwild (see NeuralNet), e.g. dtype=float32 workers=4 hogwild=true;
+         with workers > 1, every process is pinned to one BLAS thread;
+         optimizer (sgd, momentum, nesterov, rmsprop or adam) and learningRate,
+         e.g. optimizer=adam learningRate=0.002; metrics=<file> writes per-epoch
+         phase timings, throughput and peak memory as JSON lines (see
+         nnMetrics.py); resume=true continues training from the checkpoint
+         <activation>.npz
+
 @author: cfalter
 """
 import sys
+import blasThreads
+if __name__ == '__main__':
+    # must precede the first import of numpy
+    blasThreads.pinBlasThreadsForWorkers(sys.argv[4:])
+
 from nn import NeuralNet
-from activations import Tanh, Relu, Sigmoid
-from fileIO import readImages, writePredictions
+from activations import Sigmoid, activationTypes
+from optimizers import optimizerTypes
+from nnMetrics import JsonLinesWriter
+from fileIO import readImages, readImagesCached, writePredictions
 import numpy as np
 
+options = {"epochs": int, "batchSize": int, "tolerance": float, "maxUnimprovedEpochs": int,
+           "chunkSize": int, "dtype": np.dtype, "workers": int,
+           "hogwild": lambda value: value.lower() == "true",
+           "optimizer": lambda value: optimizerTypes[value.lower()], "learningRate": float,
+           "metrics": str,
+           "resume": lambda value: value.lower() == "true"}
+
+def parseOptions(args):
+    '''
+    returns a dict of keyword arguments parsed from name=value arguments; all
+    but resume are NeuralNet arguments, and optimizer and learningRate are
+    combined into one optimizer; metrics is the path of a JSON lines file
+    '''
+    kwargs = {}
+    for arg in args:
+        name, value = arg.split('=', 1)
+        if name not in options:
+            raise ValueError("Unknown option: " + name)
+        kwargs[name] = options[name](value)
+    if "optimizer" in kwargs or "learningRate" in kwargs:
+        optimizerType = kwargs.pop("optimizer", optimizerTypes["sgd"])
+        rate = kwargs.pop("learningRate", None)
+        kwargs["optimizer"] = optimizerType() if rate is None else optimizerType(learningRate = rate)
+    return kwargs
+
 def main():
     np.seterr(all='raise')
     action = sys.argv[1].lower() 
     activationArg, hiddenArg = sys.argv[2:4]
     activationArg = activationArg.lower()
-    activation = Tanh() if activationArg == "tanh" else Relu() if activationArg == "relu" else Sigmoid()
+    activation = activationTypes.get(activationArg, Sigmoid)()
     hidden = [int(sub) for sub in hiddenArg.split(',')]
+    kwargs = parseOptions(sys.argv[4:])
+    resume = kwargs.pop("resume", False)
+    if "metrics" in kwargs:
+        kwargs["metrics"] = JsonLinesWriter(kwargs["metrics"], append = resume)
     modelName = activationArg
     if action == "train":
         trainFile, testFile = "train-data.txt", "test-data.txt"
-        model = NeuralNet(activation, hidden)
-        trainData = readImages(trainFile)
-        validationData = readImages(testFile)
-        model.train(trainData, validationData, modelName)
+        model = NeuralNet(activation, hidden, **kwargs)
+        trainData = readImagesCached(trainFile)
+        validationData = readImagesCached(testFile)
+        model.train(trainData, validationData, modelName, resume)
     elif action == "test":
-        testFile, paramsFile = "test-data.txt", activationArg + ".npy"
-        model = NeuralNet(activation, hidden)
+        testFile, paramsFile = "test-data.txt", activationArg + ".npz"
+        model = NeuralNet(activation, hidden, **kwargs)
         testData = readImages(testFile)
         predictions = model.predict(testData, paramsFile)
         writePredictions(predictions, "output.txt")
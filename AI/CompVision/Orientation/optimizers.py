@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Gradient descent optimizers for NeuralNet
+
+Each optimizer allocates its state (velocities, squared-gradient averages,
+scratch space) once per weight and bias array in initialize(), and step()
+updates the weights in place. The gradients passed to step() are sums over
+a mini-batch and are overwritten; step() divides them by the batch size, so
+the step follows the mean gradient and does not grow with the batch.
+
+@author: cfalter
+"""
+
+import numpy as np
+import functools
+
+# the activation functions' learning rates were tuned on gradients summed over
+# mini-batches of 10, i.e. on 10 times the mean gradient
+tunedBatchSize = 10
+
+class Optimizer():
+
+    def __init__(self, learningRate = None):
+        '''
+        learningRate - constant step size; None uses the decaying learning rate
+                       and bias factor of the network's activation function
+        '''
+        self.learningRate = learningRate
+
+    def initialize(self, activation, Ws, Bs):
+        '''
+        allocates the state for weights Ws and biases Bs of a network with
+        activation (an Activation); must be called before the first step()
+        '''
+        self.activation = activation
+        self.states = [self.initState(P) for W, B in zip(Ws, Bs) for P in (W, B)]
+        self.steps = 0
+
+    def initState(self, P):
+        '''
+        returns the state arrays of the parameter array P
+        '''
+        return ()
+
+    def step(self, Ws, Bs, deltas, errors, epoch, batchSize = 1):
+        '''
+        updates Ws and Bs in place with one step of gradients deltas and errors,
+        which are sums over batchSize observations
+        '''
+        self.steps += 1
+        if self.learningRate is None:
+            rate = tunedBatchSize * self.activation.learningRate(epoch)
+            biasRate = self.activation.biasFactor() * rate
+        else:
+            rate = biasRate = self.learningRate
+        with np.errstate(under = 'ignore'): # tiny gradients may square to 0
+            for i in range(len(Ws)):
+                if batchSize != 1:
+                    deltas[i] *= 1.0 / batchSize
+                    errors[i] *= 1.0 / batchSize
+                self.update(Ws[i], deltas[i], self.states[2*i], rate)
+                self.update(Bs[i], errors[i], self.states[2*i + 1], biasRate)
+
+    def update(self, P, G, state, rate):
+        '''
+        updates parameters P in place with gradient G, which may be overwritten;
+        the base class takes a plain gradient descent step, P -= rate * G
+        '''
+        G *= rate
+        P -= G
+
+    def name(self):
+        return type(self).__name__.lower()
+
+class SGD(Optimizer):
+    '''
+    plain stochastic gradient descent: P -= rate * G, the update of Optimizer
+    '''
+
+class Momentum(Optimizer):
+    '''
+    gradient descent with a velocity V = momentum * V + G and P -= rate * V,
+    or with nesterov, P -= rate * (G + momentum * V)
+    '''
+    def __init__(self, learningRate = None, momentum = 0.9, nesterov = False):
+        super().__init__(learningRate)
+        self.momentum = momentum
+        self.nesterov = nesterov
+
+    def initState(self, P):
+        return (np.zeros_like(P),)
+
+    def update(self, P, G, state, rate):
+        V, = state
+        V *= self.momentum
+        V += G
+        if self.nesterov:
+            G *= rate
+            P -= G
+            np.multiply(V, rate * self.momentum, out = G)
+        else:
+            np.multiply(V, rate, out = G)
+        P -= G
+
+    def name(self):
+        return "nesterov" if self.nesterov else "momentum"
+
+class RMSProp(Optimizer):
+    '''
+    divides the gradient by the root of a running average S of its square:
+    P -= rate * G / (sqrt(S) + epsilon)
+    '''
+    def __init__(self, learningRate = 1e-3, decay = 0.9, epsilon = 1e-8):
+        super().__init__(learningRate)
+        self.decay = decay
+        self.epsilon = epsilon
+
+    def initState(self, P):
+        return np.zeros_like(P), np.empty_like(P) # S, scratch
+
+    def update(self, P, G, state, rate):
+        S, T = state
+        np.multiply(G, G, out = T)
+        T *= 1 - self.decay
+        S *= self.decay
+        S += T
+        np.sqrt(S, out = T)
+        T += self.epsilon
+        G /= T
+        G *= rate
+        P -= G
+
+class Adam(Optimizer):
+    '''
+    RMSProp with momentum and bias-corrected running averages M of the gradient
+    and V of its square (Kingma and Ba, 2015)
+    '''
+    def __init__(self, learningRate = 1e-3, beta1 = 0.9, beta2 = 0.999, epsilon = 1e-8):
+        super().__init__(learningRate)
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+
+    def initState(self, P):
+        return np.zeros_like(P), np.zeros_like(P), np.empty_like(P) # M, V, scratch
+
+    def update(self, P, G, state, rate):
+        M, V, T = state
+        np.multiply(G, 1 - self.beta1, out = T)
+        M *= self.beta1
+        M += T
+        np.multiply(G, G, out = T)
+        T *= 1 - self.beta2
+        V *= self.beta2
+        V += T
+        # T = sqrt(V / (1 - beta2^t)) + epsilon; G = rate * M / (1 - beta1^t) / T
+        np.sqrt(V, out = T)
+        T *= 1 / np.sqrt(1 - self.beta2 ** self.steps)
+        T += self.epsilon
+        np.divide(M, T, out = G)
+        G *= rate / (1 - self.beta1 ** self.steps)
+        P -= G
+
+optimizerTypes = {"sgd": SGD, "momentum": Momentum, "nesterov": functools.partial(Momentum, nesterov = True),
+                  "rmsprop": RMSProp, "adam": Adam}
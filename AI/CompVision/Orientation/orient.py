@@ -2,7 +2,7 @@
 """
 Task: Train a classifier that will predict the orientation of an image (0, 90, 180, or 270)
 To train: ./orient.py train train_file.txt model_file.txt [model]
-where [model] is one of nearest, adaboost, nnet, or best.
+where [model] is one of nearest, adaboost, nnet, or best (the 192 x 192 ReLu nnet).
 Output is [model]_file.txt, which will contain :
     * optimized parameters determined by training
     * (if necessary, for example with KNN) training data
@@ -21,15 +21,22 @@ import sys
 from knn import KNN
 from adaboost import Adaboost
 from nn import NeuralNet
-from best import Best
 from activations import Relu
 from fileIO import readImages, writePredictions
 from Prediction import checkAccuracy
 
 models = {"nearest": KNN(),
           "adaboost": Adaboost(),
-          "nnet": NeuralNet(Relu(), "192,192"),
-          'best': Best()}
+          "nnet": NeuralNet(Relu(), [192, 192]),
+          'best': NeuralNet(Relu(), [192, 192])}
+
+def train(model, trainData, paramsFile):
+    if isinstance(model, NeuralNet):
+        # the neural net stops training when its loss on held-out images stops improving
+        split = len(trainData) * 9 // 10
+        model.train(trainData[:split], trainData[split:], paramsFile)
+    else:
+        model.train(trainData, paramsFile)
 
 def main():
     action = sys.argv[1].lower() 
@@ -37,7 +44,7 @@ def main():
         trainFile, paramsFile, modelName = sys.argv[2:5]
         model = models[modelName]
         trainData = readImages(trainFile)
-        model.train(trainData, paramsFile)
+        train(model, trainData, paramsFile)
     if action == "test":
         testFile, paramsFile, modelName = sys.argv[2:5]
         model = models[modelName]
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the KNN and AdaBoost models of orient.py, run on the same
+synthetic thumbnails as testNeuralNet
+
+@author: cfalter
+"""
+
+from knn import KNN
+from adaboost import Adaboost, packedComparisons
+from Prediction import Orientation
+from DataFormats import ThumbnailSet
+from testNeuralNet import syntheticThumbnails
+
+import numpy as np
+import unittest
+import tempfile
+import os
+
+def constantThumbnails(values, orientations):
+    '''
+    Returns a ThumbnailSet of images whose 192 pixels all equal values[i]
+    '''
+    pixels = np.repeat(np.array(values, dtype = np.uint8)[:, np.newaxis], 192, axis = 1)
+    photoIds = np.array(["constant/" + str(i) + ".jpg" for i in range(len(values))])
+    return ThumbnailSet(photoIds, np.array(orientations), pixels)
+
+class testKNN(unittest.TestCase):
+
+    def test_nearestNeighborsMatchBruteForce(self):
+        train, test = syntheticThumbnails(300, 1), syntheticThumbnails(50, 2)
+        points = train.pixels.astype(np.float64)
+        queries = test.pixels.astype(np.float64)
+        distances = np.sum((queries[:, np.newaxis, :] - points[np.newaxis, :, :]) ** 2, axis = 2)
+        for blockSize in (32, 1024):
+            model = KNN(k = 7, blockSize = blockSize)
+            neighbors = model.nearestNeighbors(test.pixels, train.pixels,
+                                               np.einsum('ij,ij->i', points, points).astype(np.float32))
+            self.assertEqual(neighbors.shape, (50, 7))
+            for i in range(len(queries)):
+                self.assertEqual(len(set(neighbors[i])), 7)
+                # neighbors are the 7 smallest distances, nearest first
+                self.assertTrue(np.array_equal(distances[i, neighbors[i]], np.sort(distances[i])[:7]))
+
+    def test_predictTieGoesToNearest(self):
+        # the 4 nearest images of each query split 2 to 2 between UP and RIGHT
+        train = constantThumbnails([0, 10, 20, 30, 200], [90, 0, 90, 0, 180])
+        test = constantThumbnails([1, 29], [0, 0])
+        model = KNN(k = 4, blockSize = 2)
+        with tempfile.TemporaryDirectory() as outDir:
+            paramsFile = os.path.join(outDir, "nearest")
+            model.train(train, paramsFile)
+            predictions = model.predict(test, paramsFile)
+        self.assertEqual([p.orientation for p in predictions], [Orientation.RIGHT, Orientation.UP])
+        for prediction in predictions:
+            self.assertTrue(np.array_equal(prediction.weights, [0.5, 0.5, 0, 0]))
+
+    def test_predictSyntheticThumbnails(self):
+        train, test = syntheticThumbnails(800, 1), syntheticThumbnails(200, 2)
+        with tempfile.TemporaryDirectory() as outDir:
+            paramsFile = os.path.join(outDir, "nearest")
+            KNN(blockSize = 128).train(train, paramsFile)
+            predictions = KNN(blockSize = 128).predict(test, paramsFile)
+        accuracy = np.mean([p.orientation.value == y for p, y in zip(predictions, test.orientations)])
+        self.assertGreater(accuracy, 0.5)
+
+class testAdaboost(unittest.TestCase):
+
+    def test_signedSumsMatchUnpackedProduct(self):
+        rng = np.random.RandomState(0)
+        numPairs = 21 # not a multiple of 8, so the last byte is padded
+        packed = np.packbits(rng.rand(50, numPairs) > 0.5, axis = 1)
+        V = rng.randn(50, 4)
+        expected = np.unpackbits(packed, axis = 1, count = numPairs).T.dot(V)
+        for blockSize in (16, 64):
+            sums = Adaboost(blockSize = blockSize).signedSums(packed, V, numPairs)
+            self.assertTrue(np.allclose(sums, expected))
+
+    def test_packedBitsMatchComparisons(self):
+        pixels = syntheticThumbnails(40, 1).pixels
+        pairs = np.array([[0, 1], [5, 100], [191, 3], [17, 18], [60, 61], [2, 90], [7, 8], [9, 10], [11, 150]])
+        packed = packedComparisons(pixels, pairs, 16)
+        for f in range(len(pairs)):
+            bits = (packed[:, f // 8] >> (7 - f % 8)) & 1
+            self.assertTrue(np.array_equal(bits, pixels[:, pairs[f, 0]] > pixels[:, pairs[f, 1]]))
+
+    def test_trainPredictRoundTrip(self):
+        train, test = syntheticThumbnails(800, 1), syntheticThumbnails(200, 2)
+        with tempfile.TemporaryDirectory() as outDir:
+            paramsFile = os.path.join(outDir, "adaboost")
+            Adaboost(rounds = 20, numPairs = 500, blockSize = 256).train(train, paramsFile)
+            self.assertTrue(os.path.exists(paramsFile + ".npz"))
+            predictions = Adaboost(blockSize = 64).predict(test, paramsFile)
+        self.assertEqual([p.photoId for p in predictions], list(test.photoIds))
+        accuracy = np.mean([p.orientation.value == y for p, y in zip(predictions, test.orientations)])
+        self.assertGreater(accuracy, 0.8)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for NeuralNet, run on synthetic thumbnails whose bright half
+reveals their orientation
+
+@author: cfalter
+"""
+
+from nn import NeuralNet, writeCheckpoint, readCheckpoint
+from nnParallel import ParallelTrainer
+from activations import Relu, Tanh
+from optimizers import optimizerTypes
+from DataFormats import ThumbnailSet, normalizeRows
+from fileIO import readImagesCached
+
+import numpy as np
+import unittest
+import tempfile
+import contextlib
+import io
+import os
+import copy
+
+def syntheticThumbnails(n, seed):
+    '''
+    Returns a ThumbnailSet of n noisy 8x8x3 images that are brighter at the top,
+    each rotated to a random orientation
+    '''
+    rng = np.random.RandomState(seed)
+    orientations = rng.choice([0, 90, 180, 270], n)
+    images = rng.randint(0, 160, (n, 8, 8, 3))
+    images[:, :4] += 90
+    for i in range(n):
+        images[i] = np.rot90(images[i], orientations[i] // 90)
+    photoIds = np.array(["synthetic/" + str(i) + ".jpg" for i in range(n)])
+    return ThumbnailSet(photoIds, orientations, images.reshape(n, 192).astype(np.uint8))
+
+def trainedModel(atype, dtype, epochs = 5, optimizer = None):
+    '''
+    Returns a NeuralNet trained for a few epochs on synthetic thumbnails;
+    the random seed is fixed so that every dtype starts from the same weights
+    '''
+    np.random.seed(0)
+    model = NeuralNet(atype, [16, 8], batchSize = 16, dtype = dtype, optimizer = optimizer)
+    model.initTrainParams(syntheticThumbnails(800, 1), syntheticThumbnails(200, 2))
+    buffers, lastBuffers = model.initTrainBuffers()
+    for epoch in range(epochs):
+        model.trainEpoch(np.random.permutation(len(model.X)), epoch, buffers, lastBuffers)
+    return model
+
+class testNeuralNet(unittest.TestCase):
+
+    def test_float32Arrays(self):
+        model = trainedModel(Relu(), np.float32, epochs = 1)
+        for array in model.Ws + model.Bs + [model.X, model.Y, model.Xvalidate]:
+            self.assertEqual(array.dtype, np.float32)
+        Yhat, _ = model.forward(model.Xvalidate)
+        self.assertEqual(Yhat.dtype, np.float32)
+
+    def test_float32ListOfThumbnail(self):
+        # a list of Thumbnail has int64 pixels, which must still become float32 inputs
+        train, validation = syntheticThumbnails(200, 1), syntheticThumbnails(50, 2)
+        with tempfile.TemporaryDirectory() as outDir, contextlib.redirect_stdout(io.StringIO()):
+            paramsFile = os.path.join(outDir, "relu")
+            np.random.seed(0)
+            model = NeuralNet(Relu(), [8, 8], epochs = 2, batchSize = 16, dtype = np.float32)
+            model.train(list(train), list(validation), paramsFile)
+            self.assertEqual(model.X.dtype, np.float32)
+            fromList = model.predict(list(validation), paramsFile)
+            fromSet = model.predict(validation, paramsFile)
+            del model # release the memory-mapped weights before the directory is removed
+        self.assertEqual([p.orientation for p in fromList], [p.orientation for p in fromSet])
+        self.assertTrue(np.array_equal([p.weights for p in fromList], [p.weights for p in fromSet]))
+
+    def test_float32MatchesFloat64(self):
+        for atype in (Relu(), Tanh()):
+            model64 = trainedModel(atype, np.float64)
+            model32 = trainedModel(atype, np.float32)
+            Yhat64, _ = model64.forward(model64.Xvalidate)
+            Yhat32, _ = model32.forward(model32.Xvalidate)
+            accuracy64 = model64.accuracy(model64.Yvalidate, Yhat64)
+            accuracy32 = model32.accuracy(model32.Yvalidate, Yhat32)
+            self.assertGreater(accuracy64, 0.5)
+            self.assertAlmostEqual(accuracy32, accuracy64, delta = 0.02)
+            self.assertTrue(np.allclose(Yhat32, Yhat64, atol = 1e-3))
+            self.assertAlmostEqual(model32.loss(model32.Yvalidate, Yhat32) / len(Yhat32),
+                                   model64.loss(model64.Yvalidate, Yhat64) / len(Yhat64), delta = 1e-3)
+
+    def test_parallelMatchesSerial(self):
+        serial = trainedModel(Relu(), np.float64, epochs = 2)
+        np.random.seed(0)
+        model = NeuralNet(Relu(), [16, 8], batchSize = 16)
+        model.initTrainParams(syntheticThumbnails(800, 1), syntheticThumbnails(200, 2))
+        trainer = ParallelTrainer(model, 3)
+        try:
+            for epoch in range(2):
+                trainer.trainEpoch(np.random.permutation(len(model.X)), epoch)
+        finally:
+            trainer.close()
+        for parallel, expected in zip(model.Ws + model.Bs, serial.Ws + serial.Bs):
+            self.assertTrue(np.allclose(parallel, expected, rtol = 1e-10, atol = 1e-12))
+
+    def test_optimizers(self):
+        for name, optimizerType in optimizerTypes.items():
+            for dtype in (np.float64, np.float32):
+                model = trainedModel(Relu(), dtype, epochs = 5, optimizer = optimizerType())
+                for array in model.Ws + model.Bs:
+                    self.assertEqual(array.dtype, dtype)
+                    self.assertTrue(np.all(np.isfinite(array)))
+                Yhat, _ = model.forward(model.Xvalidate)
+                self.assertGreater(model.accuracy(model.Yvalidate, Yhat), 0.7, name)
+
+    def test_stepIndependentOfBatchSize(self):
+        # a mini-batch of one observation repeated 8 times has the same mean gradient
+        for name, optimizerType in optimizerTypes.items():
+            models = []
+            for batchSize in (1, 8):
+                np.random.seed(0)
+                model = NeuralNet(Relu(), [16, 8], batchSize = batchSize, optimizer = optimizerType())
+                model.initTrainParams(syntheticThumbnails(20, 1), syntheticThumbnails(20, 2))
+                model.trainEpoch(np.array([5] * batchSize), 0)
+                models.append(model)
+            for single, repeated in zip(models[0].Ws + models[0].Bs, models[1].Ws + models[1].Bs):
+                self.assertTrue(np.allclose(single, repeated, rtol = 1e-9, atol = 1e-12), name)
+
+    def test_metricsRecords(self):
+        records = []
+        np.random.seed(0)
+        model = NeuralNet(Relu(), [16, 8], epochs = 2, batchSize = 16, metrics = records.append)
+        with tempfile.TemporaryDirectory() as outDir, contextlib.redirect_stdout(io.StringIO()):
+            model.train(syntheticThumbnails(800, 1), syntheticThumbnails(200, 2), os.path.join(outDir, "relu"))
+        self.assertEqual([record['epoch'] for record in records], [0, 1])
+        for record in records:
+            self.assertEqual(record['samples'], 800)
+            self.assertEqual(set(record['phaseSeconds']), {"shuffle", "forward", "backprop", "validation", "checkpoint"})
+            self.assertGreater(record['samplesPerSecond'], 0)
+            for seconds in record['phaseSeconds'].values():
+                self.assertGreaterEqual(seconds, 0)
+            # the phases are disjoint intervals of the total; allow for rounding only
+            self.assertLessEqual(sum(record['phaseSeconds'].values()), record['totalSeconds'] + 1e-9)
+        self.assertEqual([(r['loss'], r['accuracy']) for r in records], [h[1:] for h in model.history[1:]])
+
+    def test_buffersMatchAllocating(self):
+        for atype in (Relu(), Tanh()):
+            np.random.seed(0)
+            allocating = NeuralNet(atype, [16, 8], batchSize = 24) # 800 % 24 leaves a last batch of 8
+            allocating.initTrainParams(syntheticThumbnails(800, 1), syntheticThumbnails(200, 2))
+            buffered = copy.deepcopy(allocating)
+            buffers, lastBuffers = buffered.initTrainBuffers()
+            self.assertEqual(lastBuffers.size, 8)
+            for epoch in range(2):
+                order = np.random.permutation(len(allocating.X))
+                allocating.trainEpoch(order, epoch)
+                buffered.trainEpoch(order, epoch, buffers, lastBuffers)
+            for a, b in zip(allocating.Ws + allocating.Bs, buffered.Ws + buffered.Bs):
+                self.assertTrue(np.array_equal(a, b))
+
+    def test_chunkedForwardMatchesTraining(self):
+        for dtype in (np.float64, np.float32):
+            model = trainedModel(Relu(), dtype, epochs = 2)
+            Yhat, _ = model.forward(model.Xvalidate, True)
+            for chunkSize in (1, 64, 1024): # 200 observations: a shorter last chunk, then a single chunk
+                model.chunkSize = chunkSize
+                chunked, lastHidden = model.forward(model.Xvalidate)
+                self.assertIsNone(lastHidden)
+                self.assertTrue(np.allclose(chunked, Yhat, rtol = 0, atol = np.finfo(dtype).eps * 4))
+
+    def test_predictNormalizesEachChunk(self):
+        model = trainedModel(Relu(), np.float32, epochs = 2)
+        expected, _ = model.forward(model.Xvalidate)
+        with tempfile.TemporaryDirectory() as outDir:
+            paramsFile = os.path.join(outDir, "relu")
+            model.saveCheckpoint(paramsFile, 1, 1.0, 0.5)
+            predictor = NeuralNet(Relu(), [16, 8], chunkSize = 64, dtype = np.float32)
+            predictions = predictor.predict(syntheticThumbnails(200, 2), paramsFile)
+            del predictor # release the memory-mapped weights before the directory is removed
+        self.assertTrue(np.allclose([p.weights for p in predictions], expected, rtol = 0, atol = 1e-6))
+
+    def test_normalizeRowsMatchesThumbnail(self):
+        thumbnails = syntheticThumbnails(50, 1)
+        expected = np.array([t.normalize() for t in thumbnails])
+        self.assertTrue(np.array_equal(normalizeRows(thumbnails.pixels), expected))
+        out = np.empty((50, 192), np.float32)
+        self.assertTrue(np.allclose(normalizeRows(thumbnails.pixels, out = out), expected, rtol = 1e-6))
+
+    def test_cachedNormalizedPixels(self):
+        def writeImages(path, thumbnails):
+            with open(path, 'w') as file:
+                for photoId, orientation, pixels in zip(thumbnails.photoIds, thumbnails.orientations, thumbnails.pixels):
+                    file.write(photoId + " " + str(orientation) + " " + " ".join(str(p) for p in pixels) + "\n")
+        with tempfile.TemporaryDirectory() as outDir:
+            path = os.path.join(outDir, "train-data.txt")
+            for seed in (1, 2): # the second file replaces the first, so the cache is rebuilt
+                thumbnails = syntheticThumbnails(40 + seed, seed)
+                writeImages(path, thumbnails)
+                os.utime(path, ns = (seed * 10**9, seed * 10**9))
+                for _ in range(2): # build, then reuse
+                    images = readImagesCached(path, dtype = np.float32)
+                    self.assertEqual(images.normalizedPixels.dtype, np.float32)
+                    self.assertTrue(np.array_equal(images.normalizedPixels,
+                                                   normalizeRows(thumbnails.pixels, out = np.empty((40 + seed, 192), np.float32))))
+                model = NeuralNet(Relu(), [16], dtype = np.float32)
+                self.assertIs(model.inputMatrix(images), images.normalizedPixels)
+                self.assertTrue(np.array_equal(model.inputMatrix(images[10:]), images.normalizedPixels[10:]))
+                del images # release the memory maps before the files are replaced
+
+    def test_checkpointRoundTrip(self):
+        rng = np.random.RandomState(0)
+        Ws = [rng.randn(192, 16), rng.randn(16, 4).astype(np.float32)]
+        Bs = [np.zeros(16), rng.randn(4).astype(np.float32)]
+        metadata = {'activation': 'relu', 'hidden': [16], 'epoch': 3, 'loss': 1.5}
+        with tempfile.TemporaryDirectory() as outDir:
+            paramsFile = os.path.join(outDir, "relu")
+            writeCheckpoint(paramsFile, Ws, Bs, metadata)
+            for mmap in (False, True):
+                readWs, readBs, readMetadata = readCheckpoint(paramsFile + ".npz", mmap)
+                self.assertEqual(readMetadata, dict(metadata, version = 1))
+                for array, expected in zip(readWs + readBs, Ws + Bs):
+                    self.assertEqual(array.dtype, expected.dtype)
+                    self.assertTrue(np.array_equal(array, expected))
+                    self.assertEqual(isinstance(array, np.memmap), mmap)
+                del readWs, readBs # release the memory maps before the directory is removed
+
+    def test_loadCheckpointRejectsOtherArchitecture(self):
+        model = trainedModel(Relu(), np.float64, epochs = 1)
+        with tempfile.TemporaryDirectory() as outDir:
+            paramsFile = os.path.join(outDir, "relu")
+            model.saveCheckpoint(paramsFile, 0, 1.0, 0.5)
+            for other in (NeuralNet(Tanh(), [16, 8]), NeuralNet(Relu(), [16, 16]), NeuralNet(Relu(), [16])):
+                with self.assertRaises(ValueError):
+                    other.loadCheckpoint(paramsFile)
+            metadata = NeuralNet(Relu(), [16, 8], dtype = np.float32).loadCheckpoint(paramsFile)
+            self.assertEqual(metadata['epoch'], 0)
+
+    def test_resumeStartsAfterCheckpointEpoch(self):
+        model = trainedModel(Relu(), np.float64, epochs = 2)
+        Yhat, _ = model.forward(model.Xvalidate)
+        loss = model.loss(model.Yvalidate, Yhat)
+        with tempfile.TemporaryDirectory() as outDir, contextlib.redirect_stdout(io.StringIO()):
+            paramsFile = os.path.join(outDir, "relu")
+            model.saveCheckpoint(paramsFile, 2, loss, model.accuracy(model.Yvalidate, Yhat))
+            resumed = NeuralNet(Relu(), [16, 8], epochs = 5, batchSize = 16)
+            resumed.train(syntheticThumbnails(800, 1), syntheticThumbnails(200, 2), paramsFile, resume = True)
+        self.assertEqual([h[0] for h in resumed.history], ["pre", 3, 4])
+        # the loss to beat is that of the checkpoint's weights, not of new random ones
+        self.assertAlmostEqual(resumed.history[0][1], loss)
+
+    def test_softmaxLargeInputs(self):
+        model = NeuralNet(Relu(), [16], dtype = np.float32)
+        Z = np.array([[1000, 999, 0, -1000], [80, 90, 100, 110]], dtype = np.float32)
+        expected = np.exp(Z - Z.max(axis = 1, keepdims = True))
+        expected /= expected.sum(axis = 1, keepdims = True)
+        with np.errstate(all = 'raise'):
+            self.assertTrue(np.allclose(model.softmax(Z), expected))
+            out, sums = np.empty_like(Z), np.empty((2, 1), np.float32)
+            self.assertTrue(np.allclose(model.softmax(Z, out = out, sums = sums), expected))
+
+    def test_lossSaturatedSoftmax(self):
+        model = NeuralNet(Relu(), [16], dtype = np.float32)
+        Ygt = np.array([[1, 0, 0, 0], [0, 0, 1, 0]], dtype = np.float32)
+        Yhat = np.array([[0, 1, 0, 0], [0.25, 0.25, 0.5, 0]], dtype = np.float32)
+        with np.errstate(all = 'raise'):
+            loss = model.loss(Ygt, Yhat)
+        self.assertTrue(np.isfinite(loss))
+        self.assertGreater(loss, 80)
+
+if __name__ == '__main__':
+    unittest.main()
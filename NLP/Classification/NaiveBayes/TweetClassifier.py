@@ -4,13 +4,17 @@ Created on Sat Oct 14 22:24:52 2017
 
 @author: Chris Falter
 """
+import json
+import os
 import re
-from collections import Counter, defaultdict
+from collections import Counter, OrderedDict, defaultdict, deque
+from itertools import islice
+from multiprocessing import Pool
 from nltk.corpus import stopwords
 from nltk import download
 import string
 import numpy as np
-import pandas as pd
+from scipy import sparse
 
 class Prediction():
     
@@ -28,13 +32,54 @@ def getLocationAndTweet(s):
     divider = s.find(' ')
     return s[:divider], s[divider + 1:] 
 
+def chunked(iterable, size):
+    '''
+    Yields successive lists of at most size items from iterable
+    '''
+    it = iter(iterable)
+    chunk = list(islice(it, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(it, size))
+
+def normalizePosteriors(estimates):
+    '''
+    Returns ndarray of posterior probabilities; each row of estimates holds
+    log posteriors up to a constant, and is normalized with log-sum-exp
+    '''
+    probabilities = np.exp(estimates - estimates.max(axis = 1, keepdims = True))
+    probabilities /= probabilities.sum(axis = 1, keepdims = True)
+    return probabilities
+
+def topK(scores, k):
+    '''
+    Returns tuple (indices, values), two (rows x k) ndarrays holding the k
+    largest entries of each row of scores in descending order. Ties are
+    broken in favour of the lower index.
+    '''
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((len(scores), 0), dtype = np.intp), np.empty((len(scores), 0), dtype = scores.dtype)
+    # the k-th largest value of each row; every larger entry is selected, and
+    # the entries equal to it are selected left to right until k are chosen
+    kth = -np.partition(-scores, k - 1, axis = 1)[:, k - 1:k]
+    above = scores > kth
+    tied = scores == kth
+    needed = k - above.sum(axis = 1, keepdims = True)
+    selected = above | (tied & (np.cumsum(tied, axis = 1) <= needed))
+    indices = np.nonzero(selected)[1].reshape(-1, k)
+    values = np.take_along_axis(scores, indices, axis = 1)
+    order = np.argsort(-values, axis = 1, kind = 'stable')
+    return np.take_along_axis(indices, order, axis = 1), np.take_along_axis(values, order, axis = 1)
+
 specialEntitiesRegex = re.compile("&[a-z]+;")
 
 def removeSpecialEntities(s):
-    m = specialEntitiesRegex.search(s)
-    while (m):
-        s = s[:m.start()] + s[m.end():]
-        m = specialEntitiesRegex.search(s)
+    # removing an entity can join its neighbours into a new one (e.g. '&am&lt;p;'),
+    # so repeat until nothing is left to remove
+    s, n = specialEntitiesRegex.subn('', s)
+    while n:
+        s, n = specialEntitiesRegex.subn('', s)
     return s
 
 cityInitials = ['la', 'orl', 'washing']
@@ -59,6 +104,187 @@ def identifyMonikers(tokens, monikers):
         return tokens + monikerList
     return tokens        
 
+class PrefixTrie():
+    '''
+    Trie that finds, in one pass over a token, every prefix it starts with.
+    expand() returns the same list as identifyCityInitials().
+    '''
+    
+    def __init__(self, prefixes):
+        self.prefixes = list(prefixes)
+        self.children = [{}] # node 0 is the root; children[node][ch] = next node
+        self.outputs = [[]] # outputs[node] = indices of the prefixes ending at node
+        for i, prefix in enumerate(self.prefixes):
+            node = 0
+            for ch in prefix:
+                if ch not in self.children[node]:
+                    self.children[node][ch] = len(self.children)
+                    self.children.append({})
+                    self.outputs.append([])
+                node = self.children[node][ch]
+            self.outputs[node].append(i)
+    
+    def matches(self, token):
+        '''
+        Returns list of the prefixes of token, in the order they were given
+        '''
+        found = list(self.outputs[0])
+        node = 0
+        for ch in token:
+            node = self.children[node].get(ch)
+            if node is None:
+                break
+            found += self.outputs[node]
+        return [self.prefixes[i] for i in sorted(found)]
+    
+    def expand(self, tokens):
+        matched = [prefix for token in tokens for prefix in self.matches(token)]
+        if matched:
+            return tokens + matched
+        return tokens
+
+class MonikerAutomaton():
+    '''
+    Aho-Corasick automaton that finds, in one pass over a token, every moniker
+    it contains, so the cost per token does not grow with the number of monikers.
+    Monikers are reported in the iteration order of the collection the automaton
+    was built from; expand() returns the same list as identifyMonikers().
+    '''
+    
+    def __init__(self, monikers):
+        self.monikers = list(monikers)
+        self.children = [{}] # node 0 is the root; children[node][ch] = next node
+        outputs = [set()] # outputs[node] = indices of the monikers that end at node
+        for i, moniker in enumerate(self.monikers):
+            node = 0
+            for ch in moniker:
+                if ch not in self.children[node]:
+                    self.children[node][ch] = len(self.children)
+                    self.children.append({})
+                    outputs.append(set())
+                node = self.children[node][ch]
+            outputs[node].add(i)
+        
+        # failure links, breadth first: fail[node] = node of the longest proper
+        # suffix of node's string that is also a prefix of some moniker
+        self.fail = [0] * len(self.children)
+        queue = deque(self.children[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.children[node].items():
+                f = self.fail[node]
+                while f and ch not in self.children[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.children[f].get(ch, 0)
+                outputs[child] |= outputs[self.fail[child]]
+                queue.append(child)
+        self.outputs = [tuple(out) for out in outputs]
+    
+    def matches(self, token):
+        '''
+        Returns list of the monikers contained in token
+        '''
+        found = set(self.outputs[0])
+        node = 0
+        for ch in token:
+            while node and ch not in self.children[node]:
+                node = self.fail[node]
+            node = self.children[node].get(ch, 0)
+            if self.outputs[node]:
+                found.update(self.outputs[node])
+        return [self.monikers[i] for i in sorted(found)]
+    
+    def expand(self, tokens):
+        matched = [moniker for token in tokens for moniker in self.matches(token)]
+        if matched:
+            return tokens + matched
+        return tokens
+
+class MonikerScan():
+    '''
+    Tests a token against every moniker in turn, as identifyMonikers() does.
+    For a few dozen monikers, such as the static ones, this is faster than a
+    MonikerAutomaton, whose per-character dictionary lookups only pay off for
+    large moniker sets.
+    '''
+    
+    def __init__(self, monikers):
+        self.monikers = list(monikers)
+    
+    def matches(self, token):
+        '''
+        Returns list of the monikers contained in token
+        '''
+        return [moniker for moniker in self.monikers if moniker in token]
+    
+    def expand(self, tokens):
+        return identifyMonikers(tokens, self.monikers)
+
+# moniker sets of at least this size are matched with a MonikerAutomaton; on
+# tweets.train.txt the linear scan is faster up to about 40 monikers
+monikerAutomatonThreshold = 40
+
+def monikerMatcher(monikers):
+    '''
+    Returns a MonikerScan or, for large moniker sets, a MonikerAutomaton
+    '''
+    if len(monikers) < monikerAutomatonThreshold:
+        return MonikerScan(monikers)
+    return MonikerAutomaton(monikers)
+
+cityInitialsTrie = PrefixTrie(cityInitials)
+
+class LRUCache():
+    '''
+    Bounded mapping that evicts the least recently used entry when it is full.
+    Counts hits, misses and evictions so its effectiveness can be reported.
+    '''
+    
+    def __init__(self, maxSize):
+        '''
+        Inputs:
+            maxSize - maximum number of entries; 0 disables the cache
+        '''
+        self.maxSize = maxSize
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def __len__(self):
+        return len(self.items)
+    
+    def get(self, key):
+        '''
+        Returns the value cached for key, or None if there is none
+        '''
+        value = self.items.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def put(self, key, value):
+        if self.maxSize <= 0:
+            return
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.maxSize:
+            self.items.popitem(last = False)
+            self.evictions += 1
+    
+    def clear(self):
+        self.items.clear()
+    
+    def stats(self):
+        '''
+        Returns dictionary of the cache's size and counters
+        '''
+        return {'size': len(self.items), 'maxSize': self.maxSize, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
 # make sure the list of stop words is available
 download("stopwords")
 
@@ -69,6 +295,27 @@ commonTweetWords = ['job','hiring','jobs','careerarc','street','opening','work',
 commonTweetWords += list("abcdefghijklmnopqrstuvwxyz") + list("01234456789")
 stopWords = set(stopwords.words('english') + commonTweetWords)
 
+class TokenCharTable(dict):
+    '''
+    str.translate table that deletes every character it has no entry for
+    '''
+    def __missing__(self, key):
+        return None
+
+# one table that strips unprintable characters, lower-cases and turns
+# punctuation into spaces, so that a tweet is rewritten in a single pass
+tokenCharTable = TokenCharTable()
+for c in printable:
+    tokenCharTable[ord(c)] = c.lower().translate(punctuationRemover)
+
+def getTokens(tweet):
+    '''
+    Returns a list of tokens after removing HTML special entities, unprintable
+    characters, punctuation and stopwords + lower-casing
+    '''
+    s = removeSpecialEntities(tweet).translate(tokenCharTable)
+    return [t for t in s.split() if t not in stopWords]
+
 parsedLocations = set()
 def parseLocationMonikers(location, monikers):
     if location in parsedLocations:
@@ -94,19 +341,234 @@ def extractMonikersFromLocation(location, monikers):
             abbreviation += tokens[i][0]
         monikers.add(abbreviation)
 
+class TokenTable():
+    '''
+    Compact index from vocabulary token to row of a prior matrix.
+    The sorted tokens are concatenated into one byte blob, delimited by an
+    offsets array, rather than kept as dictionary keys or fixed-width strings.
+    A fixed 8-byte prefix of each token narrows a bulk binary search to the
+    few tokens that share a key's prefix, whose bytes are then compared.
+    '''
+    prefixWidth = 8
+    
+    def __init__(self, tokens):
+        '''
+        Inputs:
+            tokens - list of str; the i-th token owns row i of the prior matrix
+        '''
+        self._build([t.encode('utf-8') for t in tokens], np.arange(len(tokens)))
+    
+    @staticmethod
+    def fromArrays(offsets, blob, rows):
+        '''
+        Returns a TokenTable wrapping arrays that are already sorted, such as
+        the memory-mapped arrays of a saved model
+        '''
+        table = TokenTable([])
+        table.offsets, table.blob, table.rows = offsets, blob, rows
+        table.prefixes = table._prefixes()
+        return table
+    
+    def _build(self, keys, rows):
+        '''
+        Sorts keys (list of bytes) with their rows and lays them out in the blob
+        '''
+        order = sorted(range(len(keys)), key = keys.__getitem__)
+        keys = [keys[i] for i in order]
+        self.rows = np.asarray(rows, dtype = np.intp)[order]
+        self.offsets = np.zeros(len(keys) + 1, dtype = np.int64)
+        np.cumsum([len(k) for k in keys], out = self.offsets[1:])
+        self.blob = np.frombuffer(b''.join(keys), dtype = np.uint8)
+        self.prefixes = self._prefixes()
+    
+    def _prefixes(self):
+        '''
+        Returns fixed-width byte-string ndarray of the first prefixWidth bytes of
+        each token; tokens never contain NUL, so the padding keeps the order
+        '''
+        starts, ends = self.offsets[:-1, np.newaxis], self.offsets[1:, np.newaxis]
+        indices = starts + np.arange(self.prefixWidth)
+        padded = np.zeros(indices.shape, dtype = np.uint8)
+        inside = indices < ends
+        padded[inside] = self.blob[indices[inside]]
+        return padded.view((bytes, self.prefixWidth)).ravel()
+    
+    def _token(self, position):
+        return self.blob[self.offsets[position]:self.offsets[position + 1]].tobytes()
+    
+    def __len__(self):
+        return len(self.rows)
+    
+    def add(self, tokens, firstRow):
+        '''
+        Adds tokens that are not yet in the table; the i-th new token owns
+        row firstRow + i of the prior matrix. Only the new tokens are sorted
+        and searched for; the existing entries are shifted by np.insert.
+        '''
+        keys = [t.encode('utf-8') for t in tokens]
+        order = sorted(range(len(keys)), key = keys.__getitem__)
+        keys = [keys[i] for i in order]
+        rows = np.arange(firstRow, firstRow + len(keys))[order]
+        prefixes = np.array(keys, dtype = (bytes, self.prefixWidth))
+        positions = np.searchsorted(self.prefixes, prefixes, 'left')
+        hi = np.searchsorted(self.prefixes, prefixes, 'right')
+        for i in np.flatnonzero(hi > positions):
+            positions[i] = self._bisect(keys[i], positions[i], hi[i])
+        
+        lengths = np.array([len(k) for k in keys], dtype = np.int64)
+        self.blob = np.insert(self.blob, np.repeat(self.offsets[positions], lengths),
+                              np.frombuffer(b''.join(keys), dtype = np.uint8))
+        tokenLengths = np.insert(np.diff(self.offsets), positions, lengths)
+        self.offsets = np.zeros(len(tokenLengths) + 1, dtype = np.int64)
+        np.cumsum(tokenLengths, out = self.offsets[1:])
+        self.rows = np.insert(self.rows, positions, rows)
+        self.prefixes = np.insert(self.prefixes, positions, prefixes)
+        
+    def lookup(self, tokens):
+        '''
+        Returns ndarray of prior matrix rows, one per token; -1 if the token
+        is not in the table
+        '''
+        keys = [t.encode('utf-8') for t in tokens]
+        if len(self) == 0 or len(keys) == 0:
+            return np.full(len(keys), -1, dtype = np.intp)
+        # the tokens in [lo, hi) share the key's prefix
+        prefixes = np.array(keys, dtype = (bytes, self.prefixWidth))
+        lo = np.searchsorted(self.prefixes, prefixes, 'left')
+        hi = np.searchsorted(self.prefixes, prefixes, 'right')
+        positions = np.minimum(lo, len(self) - 1)
+        for i in np.flatnonzero(hi - lo > 1):
+            positions[i] = min(self._bisect(keys[i], lo[i], hi[i]), hi[i] - 1)
+        
+        # compare the full bytes of each key with its candidate token
+        lengths = np.array([len(k) for k in keys], dtype = np.int64)
+        starts = self.offsets[positions]
+        found = (hi > lo) & (self.offsets[positions + 1] - starts == lengths)
+        long = np.flatnonzero(found & (lengths > self.prefixWidth))
+        if len(long):
+            keyBlob = np.frombuffer(b''.join([keys[i] for i in long]), dtype = np.uint8)
+            segments = np.zeros(len(long), dtype = np.int64)
+            np.cumsum(lengths[long][:-1], out = segments[1:])
+            shift = np.repeat(starts[long] - segments, lengths[long])
+            mismatches = np.add.reduceat(self.blob[shift + np.arange(len(keyBlob))] != keyBlob, segments)
+            found[long[mismatches > 0]] = False
+        return np.where(found, self.rows[positions], -1)
+    
+    def _bisect(self, key, lo, hi):
+        '''
+        Returns the position in [lo, hi) of the first token >= key, or hi if
+        there is none
+        '''
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._token(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+    
+    def tokensAt(self, rows):
+        '''
+        Returns list of str; the tokens that own the given rows
+        '''
+        positions = np.empty_like(self.rows)
+        positions[self.rows] = np.arange(len(self.rows))
+        return [self._token(p).decode('utf-8') for p in positions[rows]]
+    
+    def tokensByRow(self):
+        '''
+        Returns list of str; the i-th element is the token that owns row i
+        '''
+        return self.tokensAt(np.arange(len(self.rows)))
+
+def shardFile(path, numShards):
+    '''
+    Returns list of (start, end) byte offsets that split the file at path into
+    at most numShards ranges of roughly equal size. Every range starts at the
+    beginning of a line, and each line belongs to the range in which it starts.
+    '''
+    size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, numShards):
+            f.seek(max(size * i // numShards - 1, boundaries[-1]))
+            f.readline()
+            boundaries.append(min(max(f.tell(), boundaries[-1]), size))
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+def readShard(path, start, end, encoding):
+    '''
+    Generator of the lines that start within byte range [start, end) of path
+    '''
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line.decode(encoding)
+
+def locationsBeforeShards(path, shards, encoding):
+    '''
+    Returns list with one set per shard: the locations of all tweets that
+    precede the shard in the file
+    '''
+    result = []
+    seen = set()
+    for start, end in shards:
+        result.append(set(seen))
+        for line in readShard(path, start, end, encoding):
+            seen.add(getLocationAndTweet(line)[0])
+    return result
+
+def _countShard(args):
+    '''
+    Worker for TweetClassifier.trainParallel: counts the tweets in one shard.
+    A dynamic classifier first learns the monikers of every location that
+    precedes the shard, so that each tweet is tokenized exactly as it would
+    be by a serial pass over the file.
+    '''
+    path, start, end, encoding, isDynamicLocations, precedingLocations = args
+    classifier = TweetClassifier(isDynamicLocations)
+    for loc in precedingLocations:
+        extractMonikersFromLocation(loc, classifier.monikers)
+    classifier._countTweets(readShard(path, start, end, encoding))
+    return (classifier.numTweets, classifier.tweetCounts, classifier.wordCount,
+            dict(classifier.tokens), classifier.monikers)
+
+# on-disk model layout; bump modelFormatVersion whenever the layout changes
+modelFormatVersion = 3
+modelHeaderFile = 'model.json'
+modelArrayFiles = {'locationPrior': 'locationPrior.npy',
+                   'logCountMatrix': 'logCountMatrix.npy',
+                   'logWordTotals': 'logWordTotals.npy',
+                   'vocabularyOffsets': 'vocabularyOffsets.npy',
+                   'vocabularyBlob': 'vocabularyBlob.npy',
+                   'vocabularyRows': 'vocabularyRows.npy'}
+
 class TweetClassifier():
     '''
     train() method determines priors for P(location), P(token | location)
     test() method applies naive Bayes classification to each tweet
     '''
     
-    def __init__(self, isDynamicLocations = False):
+    def __init__(self, isDynamicLocations = False, dtype = np.float64,
+                 tokenCacheSize = 100000, tweetCacheSize = 0):
         '''
         Inputs:
-            tokenOccurrenceThreshold = minimum number of occurrences of token 
-            for it to be used in predicting location
+            isDynamicLocations = generate monikers from the training locations
+            dtype = float type of the probability tables; np.float32 halves
+            their size at the cost of exact agreement with np.float64 scores
+            tokenCacheSize = number of tokens whose initials and monikers are
+            cached; 0 disables the cache
+            tweetCacheSize = number of whole tweets whose token lists are
+            cached, which pays off for streams with many repeated tweets; 
+            0 (the default) disables the cache
         '''
+        # minimum number of occurrences of token for it to be used in predicting location
         self.tokenOccurrenceThreshold = 1
+        self.dtype = dtype
         
         # accumulators
         self.numTweets = 0
@@ -115,14 +577,25 @@ class TweetClassifier():
         self.tokens = defaultdict(Counter)
     
         # probability tables
+        # log(P(token|location)) = logCountMatrix[token] - logWordTotals is kept
+        # factored, so that new tweets only change the rows of their own tokens
         self.locationPrior = None # will be a ndarray of log(P(location))
-        self.tokenPriors = {} # dictionary: key = token, value = ndarray of P(token|location)
+        self.vocabulary = TokenTable([]) # maps token to row of logCountMatrix
+        self.logCountMatrix = None # will be a (vocabulary x locations) ndarray of log(count + 1)
+        self.logWordTotals = None # will be a ndarray of log(word count + vocabulary size)
+        self._logCountBuffer = None # logCountMatrix is a view of its first rows
         
         # dictionary to keep track of locations
         self.locations = dict()
         
         # extracting monikers
         self.isDynamicLocations = isDynamicLocations
+        self._monikerMatcher = None # built from self.monikers when first needed
+        self._monikerMatcherKey = None
+        
+        # memoized tokenization; cleared whenever the moniker matcher is rebuilt
+        self.tokenCache = LRUCache(tokenCacheSize) # token -> (initials, monikers)
+        self.tweetCache = LRUCache(tweetCacheSize) # tweet -> tuple of tokens
         if isDynamicLocations:
             self.monikers = set()
         else:
@@ -144,19 +617,50 @@ class TweetClassifier():
         Returns a list of tokens after removing punctuation and stopwords + lower-casing
         '''
         # TODO: try stemming the words
-        # remove HTML special entities (such as '&gt;') first
-        s = removeSpecialEntities(tweet)
-        # strip unprintable characters
-        s = ''.join(filter(lambda x: x in printable, s))
-        # lower-case so that each use of a word is coalesced, regardless of case
-        s = s.lower()
-        # remove punctuation
-        s = s.translate(punctuationRemover)
-        # tokenize + remove stop words
-        tokens = list(filter(lambda t: t not in stopWords, s.split()))
-        tokens = identifyCityInitials(tokens)
-        tokens = identifyMonikers(tokens, self.monikers)
+        matcher = self._getMonikerMatcher()
+        if self.tweetCache.maxSize > 0:
+            cached = self.tweetCache.get(tweet)
+            if cached is not None:
+                return list(cached)
+        tokens = getTokens(tweet)
+        # same result as expanding with cityInitialsTrie, then with the moniker matcher
+        initials = [i for token in tokens for i in self._expandToken(token, matcher)[0]]
+        tokens += initials
+        tokens += [m for token in tokens for m in self._expandToken(token, matcher)[1]]
+        if self.tweetCache.maxSize > 0:
+            self.tweetCache.put(tweet, tuple(tokens))
         return tokens
+    
+    def _expandToken(self, token, matcher):
+        '''
+        Returns tuple (city initials of token, monikers in token)
+        '''
+        if self.tokenCache.maxSize <= 0:
+            return cityInitialsTrie.matches(token), matcher.matches(token)
+        expansion = self.tokenCache.get(token)
+        if expansion is None:
+            expansion = (tuple(cityInitialsTrie.matches(token)), tuple(matcher.matches(token)))
+            self.tokenCache.put(token, expansion)
+        return expansion
+    
+    def cacheStats(self):
+        '''
+        Returns dictionary with the stats of the token and tweet caches
+        '''
+        return {'token': self.tokenCache.stats(), 'tweet': self.tweetCache.stats()}
+    
+    def _getMonikerMatcher(self):
+        '''
+        Returns the monikerMatcher() for self.monikers, rebuilding it only when
+        the moniker set has been replaced or has grown
+        '''
+        key = (id(self.monikers), len(self.monikers))
+        if key != self._monikerMatcherKey:
+            self._monikerMatcher = monikerMatcher(self.monikers)
+            self._monikerMatcherKey = key
+            self.tokenCache.clear()
+            self.tweetCache.clear()
+        return self._monikerMatcher
 
     def train(self, tweets):
         '''
@@ -166,6 +670,68 @@ class TweetClassifier():
         Input:
             tweets - list of strings. First token = location, remainder = tweet
         '''
+        self._countTweets(tweets)
+        self._calculateProbabilities()                          
+    
+    def partialFit(self, tweets):
+        '''
+        Adds tweets to a trained model. Only the rows of the tokens that occur
+        in tweets are recomputed, plus the per-location vectors, so the cost
+        is proportional to the size of tweets rather than of the whole corpus.
+        The resulting model is the same as if all tweets had been passed to a 
+        single call of train().
+        
+        Input:
+            tweets - list of strings. First token = location, remainder = tweet
+        '''
+        if self.logCountMatrix is None:
+            self.train(tweets)
+            return
+        if self.numTweets == 0:
+            raise ValueError('A loaded model has no training counts to update')
+        touched = self._countTweets(tweets)
+        self._updateProbabilities(touched)
+    
+    def trainParallel(self, path, workers = os.cpu_count(), encoding = 'latin1'):
+        '''
+        Trains on the tweets in the file at path, like train(), with the file
+        split into byte ranges that are counted in a pool of worker processes.
+        The counts are merged in file order, so the resulting model is identical
+        to the one train() builds from the same file.
+        
+        Input:
+            path - file of tweets, one per line. First token = location, remainder = tweet
+            workers - number of worker processes
+            encoding - encoding of the file
+        '''
+        shards = shardFile(path, workers)
+        if self.isDynamicLocations:
+            precedingLocations = locationsBeforeShards(path, shards, encoding)
+        else:
+            precedingLocations = [set() for _ in shards]
+        tasks = [(path, start, end, encoding, self.isDynamicLocations, locations) 
+                 for (start, end), locations in zip(shards, precedingLocations)]
+        if len(tasks) > 1:
+            with Pool(min(workers, len(tasks))) as pool:
+                results = pool.map(_countShard, tasks)
+        else:
+            results = [_countShard(task) for task in tasks]
+        for numTweets, tweetCounts, wordCount, tokens, monikers in results:
+            self.numTweets += numTweets
+            self.tweetCounts.update(tweetCounts)
+            self.wordCount.update(wordCount)
+            for token, wordBag in tokens.items():
+                self.tokens[token].update(wordBag)
+            if self.isDynamicLocations:
+                self.monikers |= monikers
+        self._calculateProbabilities()
+    
+    def _countTweets(self, tweets):
+        '''
+        Adds the location, word and token counts of tweets to the accumulators
+        Returns dictionary whose keys are the tokens counted, in order of first occurrence
+        '''
+        touched = {}
         for t in tweets:
             self.numTweets += 1
             loc, tweet = getLocationAndTweet(t)
@@ -175,22 +741,89 @@ class TweetClassifier():
             for token in self._getTokens(tweet):
                 self.wordCount[loc] += 1
                 self.tokens[token][loc] += 1  
-        self._calculateProbabilities()                          
+                touched[token] = None
+        return touched
         
-    def predict(self, tweets):
+    def predict(self, tweets, batchSize = 4096):
         '''
         Returns list of Prediction objects
         
         Input:
             tweets = list of tweets. First token = location, remainder = tweet
+            batchSize = number of tweets scored together by one sparse matrix product
         '''
         result = []
-        for t in tweets:
-            loc, tweet = getLocationAndTweet(t)
-            prediction = self._predictLocation(tweet)
-            result.append(Prediction(prediction, loc, tweet))
+        for batch in self.predictBatches(tweets, batchSize):
+            result += batch
         return result
     
+    def predictBatches(self, tweets, batchSize = 4096):
+        '''
+        Generator that yields a list of Prediction objects for each batch of
+        batchSize tweets. Only one batch is held in memory at a time, so tweets
+        can be an open file of any size.
+        
+        Input:
+            tweets = iterable of tweets. First token = location, remainder = tweet
+            batchSize = number of tweets scored together by one sparse matrix product
+        '''
+        for pairs, estimates in self._scoreBatches(tweets, batchSize):
+            yield self._toPredictions(pairs, estimates)
+    
+    def predictProba(self, tweets, batchSize = 4096):
+        '''
+        Returns tuple (predictions, probabilities):
+            predictions = list of Prediction objects, as returned by predict()
+            probabilities = (tweets x locations) ndarray of P(location | tweet);
+            column j belongs to location self.locations[j]
+        
+        Input:
+            tweets = list of tweets. First token = location, remainder = tweet
+            batchSize = number of tweets scored together by one sparse matrix product
+        '''
+        predictions, probabilities = [], []
+        for pairs, estimates in self._scoreBatches(tweets, batchSize):
+            predictions += self._toPredictions(pairs, estimates)
+            probabilities.append(normalizePosteriors(estimates))
+        return predictions, np.vstack(probabilities or [np.empty((0, len(self.locations)))])
+    
+    def predictTopK(self, tweets, k = 3, batchSize = 4096):
+        '''
+        Returns tuple (predictions, indices, probabilities):
+            predictions = list of Prediction objects, as returned by predict()
+            indices = (tweets x k) ndarray of the k most probable locations per
+            tweet, most probable first; index j means location self.locations[j]
+            probabilities = (tweets x k) ndarray of their P(location | tweet)
+        
+        Input:
+            tweets = list of tweets. First token = location, remainder = tweet
+            k = number of locations to return per tweet
+            batchSize = number of tweets scored together by one sparse matrix product
+        '''
+        predictions, indices, probabilities = [], [], []
+        for pairs, estimates in self._scoreBatches(tweets, batchSize):
+            predictions += self._toPredictions(pairs, estimates)
+            batchIndices, batchProbabilities = topK(normalizePosteriors(estimates), k)
+            indices.append(batchIndices)
+            probabilities.append(batchProbabilities)
+        k = min(k, len(self.locations))
+        return (predictions, np.vstack(indices or [np.empty((0, k), dtype = np.intp)]),
+                np.vstack(probabilities or [np.empty((0, k))]))
+    
+    def _scoreBatches(self, tweets, batchSize):
+        '''
+        Generator that yields a tuple (pairs, estimates) for each batch of tweets:
+            pairs = list of (location, tweet) tuples
+            estimates = (batch x locations) ndarray of log posteriors (up to a constant)
+        '''
+        for chunk in chunked(tweets, batchSize):
+            pairs = [getLocationAndTweet(t) for t in chunk]
+            yield pairs, self._estimateBatch([tweet for _, tweet in pairs])
+    
+    def _toPredictions(self, pairs, estimates):
+        return [Prediction(self.locations[best], loc, tweet) 
+                for (loc, tweet), best in zip(pairs, np.argmax(estimates, axis = 1))]
+    
     def _calculateProbabilities(self):
         '''
         Calculate the following prior probabilities:
@@ -204,60 +837,183 @@ class TweetClassifier():
             logarithms, which will prevent underflow (see 
         https://nlp.stanford.edu/IR-book/html/htmledition/naive-bayes-text-classification-1.html)
         '''
+        self._calculateLocationPriors()
+        
+        # Laplace smoothing step 2: add 1 to number of occurrences for each word, each location
+        # will do this while building the probability tables for P(token | location).
+        # The table is one dense (vocabulary x locations) matrix, so that a batch
+        # of tweets can be scored with a single sparse matrix product
+        vocabulary = [token for token in self.tokens if self._isInVocabulary(token)]
+        self._logCountBuffer = np.log(self._countRows(vocabulary) + 1).astype(self.dtype)
+        self.logCountMatrix = self._logCountBuffer[:len(vocabulary)]
+        self.vocabulary = TokenTable(vocabulary)
+    
+    def _calculateLocationPriors(self):
+        '''
+        Calculates log(P(location)) and the Laplace-smoothed log word totals
+        per location. Both cost time proportional to the number of locations.
+        '''
         locationDistribution = []
         for i, location in enumerate(self.tweetCounts):
             self.locations[i] = location
             locationDistribution.append(self.tweetCounts[location] / self.numTweets)
-        self.locationPrior = np.log(np.array(locationDistribution))
+        self.locationPrior = np.log(np.array(locationDistribution)).astype(self.dtype)
         
-        # Laplace smoothing step 1: add number of terms to word count
+        # Laplace smoothing step 1: add number of terms to word count.
+        # self.wordCount keeps the raw counts, so that training can continue later
         sizeVocabulary = len(self.tokens)
-        for key in self.wordCount:
-            self.wordCount[key] += sizeVocabulary 
+        wordTotals = np.array([self.wordCount[loc] + sizeVocabulary for loc in self.tweetCounts])
+        self.logWordTotals = np.log(wordTotals).astype(self.dtype)
+    
+    def _isInVocabulary(self, token):
+        wordBag = self.tokens[token]
+        return sum([wordBag[k] for k in self.tweetCounts]) >= self.tokenOccurrenceThreshold
+    
+    def _countRows(self, tokens):
+        '''
+        Returns (tokens x locations) ndarray of token occurrence counts
+        '''
+        columns = {loc: j for j, loc in enumerate(self.tweetCounts)}
+        counts = np.zeros((len(tokens), len(columns)))
+        for row, token in enumerate(tokens):
+            for loc, n in self.tokens[token].items():
+                counts[row, columns[loc]] = n
+        return counts
+    
+    def _updateProbabilities(self, touched):
+        '''
+        Brings the probability tables up to date after the counts of the
+        touched tokens (an iterable) have changed
+        '''
+        self._calculateLocationPriors()
+        numRows, numLocations = len(self.logCountMatrix), len(self.tweetCounts)
         
-        # Laplace smoothing step 2: add 1 to number of occurrences for each word, each location
-        # will do this while building the probability tables for P(token | location)
-        for token in self.tokens:
-            wordBag = self.tokens[token]
-            if sum([wordBag[k] for k in self.tweetCounts]) < self.tokenOccurrenceThreshold:
-                continue
-            priors = [(wordBag[loc] + 1) / self.wordCount[loc] for loc in self.tweetCounts]
-            self.tokenPriors[token] = np.log(np.array(priors))                
+        # new locations get a column of log(0 + 1) for every existing token
+        if numLocations > self._logCountBuffer.shape[1]:
+            buffer = np.zeros((len(self._logCountBuffer), numLocations), dtype = self.dtype)
+            buffer[:, :self._logCountBuffer.shape[1]] = self._logCountBuffer
+            self._logCountBuffer = buffer
+        
+        # recompute the rows of known tokens in place
+        touched = [token for token in touched if self._isInVocabulary(token)]
+        rows = self.vocabulary.lookup(touched)
+        known = rows >= 0
+        existing = [token for token, isKnown in zip(touched, known) if isKnown]
+        self._logCountBuffer[rows[known]] = np.log(self._countRows(existing) + 1)
+        
+        # append rows for new tokens, growing the buffer geometrically
+        new = [token for token, isKnown in zip(touched, known) if not isKnown]
+        needed = numRows + len(new)
+        if needed > len(self._logCountBuffer):
+            buffer = np.empty((max(needed, 2 * len(self._logCountBuffer)), numLocations), dtype = self.dtype)
+            buffer[:numRows] = self._logCountBuffer[:numRows]
+            self._logCountBuffer = buffer
+        self._logCountBuffer[numRows:needed] = np.log(self._countRows(new) + 1)
+        self.logCountMatrix = self._logCountBuffer[:needed]
+        self.vocabulary.add(new, numRows)
+    
+    def tokenLogPriors(self):
+        '''
+        Returns (vocabulary x locations) ndarray of log(P(token|location))
+        '''
+        return self.logCountMatrix - self.logWordTotals
     
     def _predictLocation(self, tweet):
-        tokens = self._getTokens(tweet)
-        #numTokens = len(tokens)
-        estimates = self.locationPrior.copy()
-        for token in tokens:
-            tokenPriors = self.tokenPriors.get(token)
-            if not tokenPriors is None:
-                estimates += tokenPriors
+        rows = self.vocabulary.lookup(self._getTokens(tweet))
+        rows = rows[rows >= 0]
+        estimates = self.locationPrior - len(rows) * self.logWordTotals
+        for row in rows:
+            estimates += self.logCountMatrix[row]
         return self.locations[np.argmax(estimates)]                    
     
-    def top5PerLocation(self):
+    def _estimateBatch(self, tweets):
+        '''
+        Returns (tweets x locations) ndarray of log posteriors (up to a constant)
+        
+        Input:
+            tweets = list of tweet texts, without the location token
+        '''
+        # sparse document-term count matrix; repeated (row, col) pairs are summed
+        tokens, rows = [], []
+        for i, tweet in enumerate(tweets):
+            tweetTokens = self._getTokens(tweet)
+            tokens += tweetTokens
+            rows += [i] * len(tweetTokens)
+        cols = self.vocabulary.lookup(tokens)
+        known = cols >= 0
+        rows = np.array(rows, dtype = np.intp)[known]
+        counts = sparse.csr_matrix((np.ones(len(rows), dtype = self.dtype), (rows, cols[known])), 
+                                   shape = (len(tweets), len(self.vocabulary)))
+        numKnown = np.bincount(rows, minlength = len(tweets)).astype(self.dtype)
+        return (counts.dot(self.logCountMatrix) + self.locationPrior 
+                - numKnown[:, np.newaxis] * self.logWordTotals)
+    
+    def top5PerLocation(self, k = 5, discriminative = False):
         '''
         Returns a dictionary:
             key = location
-            value = list of 5 words that predict most highly for the location
-        '''
-        # the result
-        top5Dict = {}
-        # for translating column from numbers to city names
-        cityDict = {}
-        cities = list(self.tweetCounts.keys())
-        for i, city in enumerate(cities):
-            cityDict[i] = city
-        # DataFrame with rows = word probabilities, columns = locations
-        # Instantiate from the tokenPriors dict, 
-        # with key = word and value = ndarray of probabilities (one per location)
-        vocabDf = pd.DataFrame.from_dict(self.tokenPriors, orient='index').rename(columns = cityDict)
-        for city in cities:
-            # create a DataFrame with one column containing the top 5 values
-            # for one location
-            dfCity = vocabDf[[city]].nlargest(20, columns = city)
-            # The index consists of the 5 words that are associated with the 
-            # values. Those are the words we seek!
-            top5Dict[city] = list(dfCity.index)
-        return top5Dict
-        
+            value = list of k words that predict most highly for the location,
+            best first
         
+        Inputs:
+            k = number of words per location
+            discriminative = rank words by log(P(word|location)) minus its mean
+            over all locations, rather than by log(P(word|location)) alone, so 
+            that words which are common everywhere do not crowd the list
+        '''
+        priors = self.tokenLogPriors()
+        if discriminative:
+            priors -= priors.mean(axis = 1, keepdims = True)
+        # one top-k over the transposed (locations x vocabulary) matrix ranks
+        # the words of every location at once
+        rows, _ = topK(priors.T, k)
+        return {self.locations[i]: self.vocabulary.tokensAt(rows[i]) 
+                for i in range(len(self.locations))}
+
+    def save(self, path):
+        '''
+        Writes the trained probability tables to directory path: one raw .npy
+        file per array plus a JSON header with the format version, the
+        locations and the monikers. Training counts are not saved, so a loaded
+        model can predict but not partialFit.
+        '''
+        os.makedirs(path, exist_ok = True)
+        arrays = {'locationPrior': self.locationPrior,
+                  'logCountMatrix': self.logCountMatrix,
+                  'logWordTotals': self.logWordTotals,
+                  'vocabularyOffsets': self.vocabulary.offsets,
+                  'vocabularyBlob': self.vocabulary.blob,
+                  'vocabularyRows': self.vocabulary.rows}
+        for name, fileName in modelArrayFiles.items():
+            np.save(os.path.join(path, fileName), np.ascontiguousarray(arrays[name]))
+        header = {'version': modelFormatVersion,
+                  'dtype': np.dtype(self.dtype).name,
+                  'isDynamicLocations': self.isDynamicLocations,
+                  'locations': [self.locations[i] for i in range(len(self.locations))],
+                  'monikers': sorted(self.monikers)}
+        with open(os.path.join(path, modelHeaderFile), 'w', encoding='utf-8') as f:
+            json.dump(header, f)
+    
+    @staticmethod
+    def load(path):
+        '''
+        Returns a TweetClassifier ready to predict, read from a directory written
+        by save(). The arrays are memory-mapped read-only, so loading is fast and
+        processes that load the same model share its pages.
+        '''
+        with open(os.path.join(path, modelHeaderFile), 'r', encoding='utf-8') as f:
+            header = json.load(f)
+        if header.get('version') != modelFormatVersion:
+            raise ValueError('Unsupported model format version: ' + str(header.get('version')))
+        arrays = {name: np.load(os.path.join(path, fileName), mmap_mode = 'r')
+                  for name, fileName in modelArrayFiles.items()}
+        classifier = TweetClassifier(header['isDynamicLocations'], np.dtype(header['dtype']).type)
+        classifier.monikers = set(header['monikers'])
+        classifier.locations = dict(enumerate(header['locations']))
+        classifier.locationPrior = arrays['locationPrior']
+        classifier.logCountMatrix = arrays['logCountMatrix']
+        classifier.logWordTotals = arrays['logWordTotals']
+        classifier.vocabulary = TokenTable.fromArrays(arrays['vocabularyOffsets'], 
+                                                      arrays['vocabularyBlob'],
+                                                      arrays['vocabularyRows'])
+        return classifier
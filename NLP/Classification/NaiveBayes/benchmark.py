@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Measures tokenization and prediction throughput of TweetClassifier in tweets/sec
+
+Usage: python benchmark.py path-to-training-data path-to-test-data
+
+@author: Chris Falter
+"""
+import sys
+import time
+from TweetClassifier import TweetClassifier, getLocationAndTweet, getTokens
+
+def tweetsPerSecond(func, items, repeats = 3):
+    '''
+    Returns the best throughput of func over items, in items per second
+    '''
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(items)
+        best = min(best, time.perf_counter() - start)
+    return len(items) / best
+
+def main():
+    trainPath, testPath = sys.argv[1], sys.argv[2]
+    with open(trainPath, 'r', encoding='latin1', newline='\n') as trainTweets:
+        lines = trainTweets.readlines()
+    with open(testPath, 'r', encoding='latin1', newline='\n') as testTweets:
+        testLines = testTweets.readlines()
+    tweets = [getLocationAndTweet(t)[1] for t in lines]
+    
+    classifier = TweetClassifier(True)
+    classifier.train(lines)
+    uncached = TweetClassifier(True, tokenCacheSize = 0)
+    uncached.train(lines)
+    tweetCached = TweetClassifier(True, tweetCacheSize = 100000)
+    tweetCached.train(lines)
+    results = [("getTokens", tweetsPerSecond(lambda ts: [getTokens(t) for t in ts], tweets)),
+               ("_getTokens, no cache", tweetsPerSecond(lambda ts: [uncached._getTokens(t) for t in ts], tweets)),
+               ("_getTokens, token cache", tweetsPerSecond(lambda ts: [classifier._getTokens(t) for t in ts], tweets)),
+               ("_getTokens, tweet cache", tweetsPerSecond(lambda ts: [tweetCached._getTokens(t) for t in ts], tweets)),
+               ("predict", tweetsPerSecond(classifier.predict, testLines))]
+    for name, rate in results:
+        print(name + ": " + str(round(rate)) + " tweets/sec")
+    print("Cache stats: " + str(tweetCached.cacheStats()))
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ Created on Sat Oct 14 19:44:07 2017
 @author: Chris Falter 
 """
 import nltk
+import os
 import sys
 from TweetClassifier import TweetClassifier
 
@@ -13,42 +14,67 @@ def printWordsForLocation(location, words):
     print("Location: " + location + " Top 5: " + str(words))
     
 
-def main():    
-    trainPath, testPath, outputPath = sys.argv[1], sys.argv[2], sys.argv[3]
-    classifierDynamic = TweetClassifier(True)
-    with open(trainPath, 'r', encoding='latin1', newline='\n') as trainTweets:
-        classifierDynamic.train(trainTweets)
-    with open(testPath, 'r', encoding='latin1', newline='\n') as testTweets:
-        predictionsDynamic = classifierDynamic.predict(testTweets)    
-    correctDynamic = sum([p.predicted == p.actual for p in predictionsDynamic])
-    print("Accuracy of dynamic feature generation = " + str(correctDynamic / len(predictionsDynamic)))
-
-    classifierStatic = TweetClassifier(False)
-    with open(trainPath, 'r', encoding='latin1', newline='\n') as trainTweets:
-        classifierStatic.train(trainTweets)
-    with open(testPath, 'r', encoding='latin1', newline='\n') as testTweets:
-        predictionsStatic = classifierStatic.predict(testTweets)    
-    correctStatic = sum([p.predicted == p.actual for p in predictionsStatic])
-
-    if correctStatic > correctDynamic:
-        predictions = predictionsStatic
-        correct = correctStatic
-        classifier = classifierStatic
-    else:
-        predictions = predictionsDynamic
-        correct = correctDynamic
-        classifier = classifierDynamic
+def predictToFile(classifier, testPath, outputPath):
+    '''
+    Streams predictions for the tweets in testPath into outputPath one batch
+    at a time, so memory use does not grow with the size of the test file.
+    Returns the accuracy, which is accumulated batch by batch.
+    '''
+    correct, total = 0, 0
+    with open(testPath, 'r', encoding='latin1', newline='\n') as testTweets, \
+         open(outputPath, 'w', encoding='latin1') as output:
+        for predictions in classifier.predictBatches(testTweets):
+            output.writelines(' '.join([p.predicted, p.actual, p.tweet]) for p in predictions)
+            correct += sum([p.predicted == p.actual for p in predictions])
+            total += len(predictions)
+    return correct / total
 
-    print("Accuracy = " + str(correct / len(predictions)))
+def printResults(classifier, accuracy):
+    print("Accuracy = " + str(accuracy))
        
     # print top 5 predicted words per location
     top5PerLocation = classifier.top5PerLocation()
     for loc in top5PerLocation:
         printWordsForLocation(loc, top5PerLocation[loc])
-        
-    with open(outputPath, 'w', encoding='latin1') as output:
-        for p in predictions:
-            output.write(' '.join([p.predicted, p.actual, p.tweet]))
+
+def trainClassifier(trainPath, isDynamicLocations):
+    classifier = TweetClassifier(isDynamicLocations)
+    classifier.trainParallel(trainPath, encoding='latin1')
+    return classifier
+
+def predictFromSavedModel(modelPath, testPath, outputPath):
+    classifier = TweetClassifier.load(modelPath)
+    accuracy = predictToFile(classifier, testPath, outputPath)
+    printResults(classifier, accuracy)
+
+def main():    
+    if sys.argv[1] == "--model":
+        modelPath, testPath, outputPath = sys.argv[2], sys.argv[3], sys.argv[4]
+        predictFromSavedModel(modelPath, testPath, outputPath)
+        return
+    trainPath, testPath, outputPath = sys.argv[1], sys.argv[2], sys.argv[3]
+    modelPath = sys.argv[4] if len(sys.argv) > 4 else None
+    
+    # each classifier streams its predictions into its own file; the file of
+    # the more accurate classifier becomes the output
+    dynamicPath, staticPath = outputPath + ".dynamic", outputPath + ".static"
+    classifierDynamic = trainClassifier(trainPath, True)
+    accuracyDynamic = predictToFile(classifierDynamic, testPath, dynamicPath)
+    print("Accuracy of dynamic feature generation = " + str(accuracyDynamic))
+
+    classifierStatic = trainClassifier(trainPath, False)
+    accuracyStatic = predictToFile(classifierStatic, testPath, staticPath)
+
+    if accuracyStatic > accuracyDynamic:
+        classifier, accuracy, bestPath, otherPath = classifierStatic, accuracyStatic, staticPath, dynamicPath
+    else:
+        classifier, accuracy, bestPath, otherPath = classifierDynamic, accuracyDynamic, dynamicPath, staticPath
+    os.replace(bestPath, outputPath)
+    os.remove(otherPath)
+
+    printResults(classifier, accuracy)
+    if modelPath:
+        classifier.save(modelPath)
         
 if __name__ == "__main__":
     main()
@@ -7,12 +7,35 @@ Created on Sun Oct 15 20:41:00 2017
 
 from TweetClassifier import (
         TweetClassifier, 
+        TokenTable,
+        LRUCache,
+        MonikerAutomaton,
+        MonikerScan,
+        monikerMatcher,
+        monikerAutomatonThreshold,
+        PrefixTrie,
+        cityInitials,
+        identifyCityInitials,
+        identifyMonikers,
         getLocationAndTweet, 
         removeSpecialEntities,
         getTokens
         )
 
+import tempfile
 import unittest
+from unittest import mock
+
+sampleTweets = ["Manhattan,_NY Mambo, Mambo! Hottest dance in Manhattan! Come to the NY disco!",
+                "Manhattan,_NY Tango, Tango! Hottest dance in NYC! party tonight!",
+                "Los_Angeles,_CA Simpson Garcetti Clark Rams Chargers",
+                "Los_Angeles,_CA Simpson Garcetti Clark Rams Chargers Dodgers",
+                "Washington,_DC Join the New Signature team! #Washington, DC #Hiring",
+                "Washington,_DC Capitol Hill dance party &amp; mambo tonight"]
+testTweets = ["Manhattan,_NY Mambo at the disco in NYC",
+              "Los_Angeles,_CA Dodgers and Rams tonight",
+              "Washington,_DC Capitol Hill tango",
+              "Manhattan,_NY words never seen in training"]
 
 class testTweetClassifier(unittest.TestCase):
     
@@ -40,6 +63,12 @@ class testTweetClassifier(unittest.TestCase):
         expected = tweet
         self.assertEqual(actual, expected)
 
+    def test_removeSpecialEntities_EntityRevealedByRemoval_RemovesBoth(self):
+        tweet = "Salt &am&lt;p; pepper"
+        actual = removeSpecialEntities(tweet)
+        expected = "Salt  pepper"
+        self.assertEqual(actual, expected)
+
     def test_getTokens_RemovesSpecialEntities(self):
         tweet = "jogging &lt;&gt; running &amp; stick-ball &lt;&gt; baseball"
         expected = ['jogging','running','stick-ball','baseball']
@@ -90,6 +119,158 @@ class testTweetClassifier(unittest.TestCase):
         expectedLA = set(["simpson","garcetti","clark","rams","chargers"])
         actualLA = set(top5List["Los_Angeles,_CA"])
         self.assertSetEqual(expectedLA, actualLA)
+
+    def test_PrefixTrie_expand_MatchesIdentifyCityInitials(self):
+        tokens = ['lakers', 'orlando', 'washington', 'la', 'or', 'dallas', 'washingla']
+        self.assertListEqual(PrefixTrie(cityInitials).expand(tokens), identifyCityInitials(tokens))
+
+    def test_MonikerAutomaton_expand_MatchesIdentifyMonikers(self):
+        monikers = set(['ny', 'nyc', 'york', 'manh', 'yc', 'c', 'angel', 'ange', 'ng'])
+        tokens = ['newyorkcity', 'nyc', 'manhattan', 'losangeles', 'angelnyc', 'xyz', 'ngngng']
+        self.assertListEqual(MonikerAutomaton(monikers).expand(tokens), identifyMonikers(tokens, monikers))
+
+    def test_monikerMatcher_SmallSetsScanLinearly(self):
+        self.assertIsInstance(monikerMatcher(TweetClassifier(False).monikers), MonikerScan)
+        large = set('m' + str(i) for i in range(monikerAutomatonThreshold))
+        self.assertIsInstance(monikerMatcher(large), MonikerAutomaton)
+        tokens = ['newyorkcity', 'm12m3', 'manhattan', 'xm39']
+        for monikers in [set(['ny', 'york', 'c', 'manh']), large]:
+            matcher = monikerMatcher(monikers)
+            self.assertListEqual(matcher.expand(tokens), identifyMonikers(tokens, monikers))
+            self.assertListEqual([m for t in tokens for m in matcher.matches(t)], identifyMonikers(tokens, monikers)[len(tokens):])
+
+    def test_LRUCache_Full_EvictsLeastRecentlyUsed(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertDictEqual(cache.stats(), {'size': 2, 'maxSize': 2, 'hits': 2, 'misses': 1, 'evictions': 1})
+
+    def test_getTokens_WithCaches_MatchesUncached(self):
+        uncached = TweetClassifier(True, tokenCacheSize = 0)
+        cached = TweetClassifier(True, tokenCacheSize = 5, tweetCacheSize = 2)
+        for classifier in [uncached, cached]:
+            classifier.train(sampleTweets)
+        for t in testTweets * 2 + sampleTweets:
+            _, tweet = getLocationAndTweet(t)
+            self.assertListEqual(uncached._getTokens(tweet), cached._getTokens(tweet))
+        self.assertGreater(cached.cacheStats()['token']['hits'], 0)
+
+    def test_TokenTable_lookup_ReturnsRowOrMinusOne(self):
+        table = TokenTable(['mambo', 'dance', 'tango', 'ny'])
+        rows = table.lookup(['tango', 'disco', 'ny', 'mambo', 'dancer', ''])
+        self.assertListEqual(list(rows), [2, -1, 3, 0, -1, -1])
+        self.assertListEqual(table.tokensByRow(), ['mambo', 'dance', 'tango', 'ny'])
+
+    def test_TokenTable_lookup_TokensSharingPrefix(self):
+        tokens = ['downloading', 'download', 'downtown', 'downloads', 'dow', 'downloadable']
+        table = TokenTable(tokens)
+        keys = tokens + ['downloa', 'downloadx', 'downloadings', 'downtowns', 'do', 'zzzzzzzzzz']
+        self.assertListEqual(list(table.lookup(keys)), list(range(6)) + [-1] * 6)
+        table.add(['downloader', 'a'], 6)
+        self.assertListEqual(list(table.lookup(['downloader', 'download', 'a', 'downloade'])), [6, 1, 7, -1])
+        self.assertListEqual(table.tokensByRow(), tokens + ['downloader', 'a'])
+
+    def test_top5PerLocation_Discriminative_DemotesWordsCommonToAllLocations(self):
+        classifier = TweetClassifier(False)
+        classifier.train(sampleTweets)
+        top = classifier.top5PerLocation(k = 3, discriminative = True)
+        self.assertEqual(len(top["Washington,_DC"]), 3)
+        self.assertNotIn("dance", top["Washington,_DC"])
+        self.assertNotIn("dance", top["Manhattan,_NY"])
+
+    def test_predict_MatchesPerTweetPrediction(self):
+        classifier = TweetClassifier(True)
+        classifier.train(sampleTweets)
+        predictions = classifier.predict(testTweets, batchSize = 3)
+        self.assertEqual(len(predictions), len(testTweets))
+        for p, t in zip(predictions, testTweets):
+            loc, tweet = getLocationAndTweet(t)
+            self.assertEqual(p.actual, loc)
+            self.assertEqual(p.tweet, tweet)
+            self.assertEqual(p.predicted, classifier._predictLocation(tweet))
+
+    def test_predictBatches_YieldsBatchesOfBatchSize(self):
+        classifier = TweetClassifier(True)
+        classifier.train(sampleTweets)
+        batches = list(classifier.predictBatches(iter(testTweets), batchSize = 3))
+        self.assertListEqual([len(b) for b in batches], [3, 1])
+        expected = [p.predicted for p in classifier.predict(testTweets)]
+        self.assertListEqual([p.predicted for b in batches for p in b], expected)
+
+    def test_trainParallel_MatchesSerialTraining(self):
+        with tempfile.TemporaryDirectory() as path:
+            trainPath = path + '/tweets.txt'
+            with open(trainPath, 'w', encoding='latin1', newline='\n') as f:
+                f.write('\n'.join(sampleTweets * 3) + '\n')
+            for isDynamicLocations in [True, False]:
+                serial = TweetClassifier(isDynamicLocations)
+                with open(trainPath, 'r', encoding='latin1', newline='\n') as f:
+                    serial.train(f)
+                parallel = TweetClassifier(isDynamicLocations)
+                parallel.trainParallel(trainPath, workers = 3)
+                self.assertEqual(serial.tokens, parallel.tokens)
+                self.assertListEqual(list(serial.tweetCounts), list(parallel.tweetCounts))
+                self.assertSetEqual(serial.monikers, parallel.monikers)
+                self.assertTrue((serial.logCountMatrix == parallel.logCountMatrix).all())
+
+    def test_partialFit_MatchesTrainingOnAllTweets(self):
+        for isDynamicLocations in [True, False]:
+            full = TweetClassifier(isDynamicLocations)
+            full.train(sampleTweets + testTweets)
+            incremental = TweetClassifier(isDynamicLocations)
+            incremental.train(sampleTweets[:2])
+            incremental.partialFit(sampleTweets[2:])
+            incremental.partialFit(testTweets)
+            self.assertEqual(full.wordCount, incremental.wordCount)
+            self.assertListEqual(full.vocabulary.tokensByRow(), incremental.vocabulary.tokensByRow())
+            self.assertTrue((full.logCountMatrix == incremental.logCountMatrix).all())
+            self.assertTrue((full.logWordTotals == incremental.logWordTotals).all())
+            self.assertTrue((full.locationPrior == incremental.locationPrior).all())
+
+    def test_partialFit_UpdateCostIndependentOfVocabularySize(self):
+        # partialFit reads tokens back out of the table only to order new
+        # tokens that share a prefix with old ones, so a larger vocabulary
+        # must not add work to the same update
+        fillerTweets = ["Manhattan,_NY qz{0:05d}".format(i) for i in range(2000)]
+        counts = []
+        for extra in [[], fillerTweets]:
+            classifier = TweetClassifier(True)
+            classifier.train(sampleTweets + extra)
+            with mock.patch.object(TokenTable, '_token', autospec = True,
+                                   side_effect = TokenTable._token) as token:
+                classifier.partialFit(testTweets)
+            counts.append(token.call_count)
+            tokens = classifier.vocabulary.tokensByRow()
+            self.assertListEqual(list(classifier.vocabulary.lookup(tokens)), list(range(len(tokens))))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_predictTopK_ReturnsSortedPosteriorsConsistentWithPredict(self):
+        classifier = TweetClassifier(True)
+        classifier.train(sampleTweets)
+        predictions, probabilities = classifier.predictProba(testTweets, batchSize = 3)
+        _, indices, topProbabilities = classifier.predictTopK(testTweets, k = 2, batchSize = 3)
+        self.assertEqual(probabilities.shape, (len(testTweets), 3))
+        self.assertEqual(indices.shape, (len(testTweets), 2))
+        for i, p in enumerate(predictions):
+            self.assertAlmostEqual(probabilities[i].sum(), 1.0)
+            self.assertEqual(p.predicted, classifier.locations[indices[i, 0]])
+            self.assertGreaterEqual(topProbabilities[i, 0], topProbabilities[i, 1])
+            self.assertAlmostEqual(topProbabilities[i, 0], probabilities[i].max())
+
+    def test_saveAndLoad_LoadedModelPredictsTheSame(self):
+        classifier = TweetClassifier(True)
+        classifier.train(sampleTweets)
+        with tempfile.TemporaryDirectory() as path:
+            classifier.save(path)
+            loaded = TweetClassifier.load(path)
+            expected = [p.predicted for p in classifier.predict(testTweets)]
+            actual = [p.predicted for p in loaded.predict(testTweets)]
+            self.assertListEqual(expected, actual)
+            self.assertSetEqual(classifier.monikers, loaded.monikers)
         
 
 if __name__ == '__main__':